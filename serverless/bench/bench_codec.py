@@ -0,0 +1,107 @@
+# Micro-benchmark: boto3's TypeDeserializer/TypeSerializer (what the resource
+# layer runs on every item) against src.codec on article pages, plus a full
+# Table.query round trip through stubbed clients. Run from the serverless
+# directory:
+#   PYTHONPATH=commonPackages/python python bench/bench_codec.py
+import copy
+import os
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+from botocore.stub import Stubber
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from src import codec, db
+
+NUMBER = 500
+
+
+def make_article(i):
+    return {
+        "slug": f"how-to-train-your-dragon-{i:08x}",
+        "title": "How to train your dragon",
+        "description": "Ever wonder how?",
+        "body": "It takes a Jacobian. " * 20,
+        "author": f"author {i % 7}",
+        "dummy": "partition",
+        "createdAt": 1700000000 + i,
+        "updatedAt": 1700000000 + i,
+        "favoritesCount": i % 11,
+        "tagList": ["dragons", "training", f"tag{i % 5}"],
+    }
+
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def resource_decode(items):
+    return [
+        {name: deserializer.deserialize(value) for name, value in item.items()}
+        for item in items
+    ]
+
+
+def resource_encode(items):
+    return [
+        {name: serializer.serialize(value) for name, value in item.items()}
+        for item in items
+    ]
+
+
+def report(label, baseline, fast):
+    print(f"{label:28} boto3 {baseline / NUMBER * 1e6:9.1f} us")
+    print(f"{'':28} codec {fast / NUMBER * 1e6:9.1f} us  {baseline / fast:5.2f}x")
+
+
+for size in [20, 100]:
+    articles = [make_article(i) for i in range(size)]
+    wire = codec.encode_item({"Items": articles})["Items"]["L"]
+    wire = [element["M"] for element in wire]
+    assert resource_decode(wire) == [
+        codec.decode_item(item, codec.ARTICLE) for item in wire
+    ]
+
+    report(
+        f"decode {size} items",
+        timeit.timeit(lambda: resource_decode(wire), number=NUMBER),
+        timeit.timeit(
+            lambda: [codec.decode_item(item, codec.ARTICLE) for item in wire],
+            number=NUMBER,
+        ),
+    )
+    report(
+        f"encode {size} items",
+        timeit.timeit(lambda: resource_encode(articles), number=NUMBER),
+        timeit.timeit(lambda: [codec.encode_item(a) for a in articles], number=NUMBER),
+    )
+
+    # Whole query calls, including botocore request handling and the
+    # resource layer's shape walking, against stubbed responses
+    resource_table = db.get_resource().Table("dev-articles")
+    typed_table = db.table("articles")
+    params = {"KeyConditionExpression": "author = :author", "Limit": size}
+    values = {":author": "author 1"}
+    response = {"Items": wire, "Count": size}
+    with Stubber(resource_table.meta.client) as resource_stub, Stubber(
+        db.get_raw_client()
+    ) as raw_stub:
+        for _ in range(NUMBER):
+            # Both layers decode the response in place
+            resource_stub.add_response("query", copy.deepcopy(response))
+            raw_stub.add_response("query", copy.deepcopy(response))
+        report(
+            f"Table.query {size} items",
+            timeit.timeit(
+                lambda: resource_table.query(
+                    ExpressionAttributeValues=values, **params
+                ),
+                number=NUMBER,
+            ),
+            timeit.timeit(
+                lambda: typed_table.query(ExpressionAttributeValues=values, **params),
+                number=NUMBER,
+            ),
+        )
@@ -0,0 +1,62 @@
+# Cold-start benchmark: import time and first-use init time per handler
+# module, each measured in a fresh interpreter. Run from the serverless
+# directory, optionally with a checkout of an older tree to compare against:
+#   PYTHONPATH=commonPackages/python python bench/bench_cold_start.py
+#   git worktree add /tmp/baseline <commit>
+#   PYTHONPATH=commonPackages/python python bench/bench_cold_start.py /tmp/baseline/serverless
+# Both trees use this tree's commonPackages, so only the handler code differs.
+import os
+import subprocess
+import sys
+
+RUNS = 10
+HANDLERS = ["src.user", "src.article", "src.comment"]
+
+# Trees with src.db build the shared resource and the plain client on first
+# use; older trees built one resource per handler module at import, so init
+# has nothing left to do there
+PROBE = """
+import time
+start = time.perf_counter()
+import importlib
+module = importlib.import_module({module!r})
+imported = time.perf_counter()
+if {lazy!r}:
+    import src.db as db
+    db.get_resource().meta.client
+    db.get_raw_client()
+initialized = time.perf_counter()
+print(imported - start, initialized - imported)
+"""
+
+root = os.path.dirname(os.path.abspath(os.path.dirname(__file__)))
+
+
+def measure(tree, module):
+    env = dict(os.environ)
+    env.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    env["PYTHONPATH"] = os.pathsep.join(
+        [tree, os.path.join(root, "commonPackages", "python")]
+    )
+    lazy = os.path.exists(os.path.join(tree, "src", "db.py"))
+    code = PROBE.format(module=module, lazy=lazy)
+    samples = []
+    for _ in range(RUNS):
+        out = subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, check=True
+        )
+        samples.append([float(value) for value in out.stdout.split()])
+    imported, initialized = [min(s[i] for s in samples) * 1000 for i in range(2)]
+    total = min(sum(sample) for sample in samples) * 1000
+    return imported, initialized, total
+
+
+trees = [("current", root)] + [("baseline", path) for path in sys.argv[1:2]]
+for label, tree in trees:
+    for module in HANDLERS:
+        imported, initialized, total = measure(os.path.abspath(tree), module)
+        print(
+            f"{label:8} {module:12} import {imported:7.1f} ms"
+            f"  init {initialized:7.1f} ms  total {total:7.1f} ms"
+        )
@@ -0,0 +1,62 @@
+# Micro-benchmark: response encoding of article pages with the old
+# json.dumps(default=int) against util.encode_json, with Decimal numbers (as
+# read through the resource layer) and with ints (as read through src.codec).
+# Run from the serverless directory:
+#   PYTHONPATH=commonPackages/python python bench/bench_encode.py
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from src import util
+
+NUMBER = 2000
+
+
+def make_article(i, number):
+    return {
+        "slug": f"how-to-train-your-dragon-{i:08x}",
+        "title": "How to train your dragon",
+        "description": "Ever wonder how?",
+        "body": "It takes a Jacobian. " * 20,
+        "tagList": ["dragons", "training", f"tag{i % 5}"],
+        "createdAt": "2023-11-14T22:13:20.000Z",
+        "updatedAt": "2023-11-14T22:13:20.000Z",
+        "favorited": i % 3 == 0,
+        "favoritesCount": number(i % 11),
+        "author": {
+            "username": f"author {i % 7}",
+            "bio": "I work at statefarm",
+            "image": "https://i.stack.imgur.com/xHWG8.jpg",
+            "following": False,
+        },
+    }
+
+
+backends = [("json", "stdlib")]
+if util.orjson is not None:
+    backends.append(("auto", "orjson"))
+else:
+    print("orjson is not installed, measuring the stdlib encoder only")
+
+for size in [20, 100]:
+    for label, number in [("Decimal", Decimal), ("int", int)]:
+        page = {
+            "articles": [make_article(i, number) for i in range(size)],
+            "articlesCount": size,
+        }
+        baseline = timeit.timeit(lambda: json.dumps(page, default=int), number=NUMBER)
+        print(f"{size} articles, {label} numbers")
+        print(f"  json.dumps(default=int) {baseline / NUMBER * 1e6:8.1f} us")
+        for encoder, name in backends:
+            util.JSON_ENCODER = encoder
+            assert json.loads(util.encode_json(page)) == json.loads(
+                json.dumps(page, default=int)
+            )
+            fast = timeit.timeit(lambda: util.encode_json(page), number=NUMBER)
+            print(
+                f"  encode_json {name:11} {fast / NUMBER * 1e6:8.1f} us"
+                f"  {baseline / fast:5.2f}x"
+            )
@@ -0,0 +1,42 @@
+# Micro-benchmark: generic jwt.decode against the precompiled TokenVerifier.
+# Run from the serverless directory:
+#   PYTHONPATH=commonPackages/python python bench/bench_tokens.py
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+import jwt
+from src import tokens
+from src.util import JWT_SECRET_KEY, JWT_ALGORITHM
+
+NUMBER = 20000
+
+token = jwt.encode(
+    {"username": "john doe", "exp": datetime.utcnow() + timedelta(days=2)},
+    JWT_SECRET_KEY,
+    JWT_ALGORITHM,
+)
+verifier = tokens.TokenVerifier(JWT_SECRET_KEY, JWT_ALGORITHM)
+assert verifier.decode(token) == jwt.decode(token, JWT_SECRET_KEY, [JWT_ALGORITHM])
+
+generic = timeit.timeit(
+    lambda: jwt.decode(token, JWT_SECRET_KEY, [JWT_ALGORITHM]), number=NUMBER
+)
+fast = timeit.timeit(lambda: verifier.decode(token), number=NUMBER)
+print(f"jwt.decode            {generic / NUMBER * 1e6:8.2f} us/token")
+print(f"TokenVerifier.decode  {fast / NUMBER * 1e6:8.2f} us/token")
+print(f"speedup               {generic / fast:8.2f}x")
+
+payload = {"username": "john doe", "exp": datetime.utcnow() + timedelta(days=2)}
+signer = tokens.TokenSigner(JWT_SECRET_KEY, JWT_ALGORITHM)
+assert signer.encode(payload) == jwt.encode(payload, JWT_SECRET_KEY, JWT_ALGORITHM)
+
+generic = timeit.timeit(
+    lambda: jwt.encode(payload, JWT_SECRET_KEY, JWT_ALGORITHM), number=NUMBER
+)
+fast = timeit.timeit(lambda: signer.encode(payload), number=NUMBER)
+print(f"jwt.encode            {generic / NUMBER * 1e6:8.2f} us/token")
+print(f"TokenSigner.encode    {fast / NUMBER * 1e6:8.2f} us/token")
+print(f"speedup               {generic / fast:8.2f}x")
@@ -1,23 +1,31 @@
 import json
-import boto3
+import heapq
+import itertools
+import src.db as db
 import logging
 import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from slugify import slugify
 from boto3.dynamodb.conditions import Key, Attr
 import src.user as user
+import src.feed as feed
+import src.article_index as article_index
+import src.pagination as pagination
 from src.util import *
 
-dynamodb = boto3.resource("dynamodb", region_name="ap-northeast-2")
-articles_table = dynamodb.Table("dev-articles")
+dynamodb = db.dynamodb
+articles_table = db.table("articles")
+tags_cache = TTLCache(maxsize=1, ttl=TAG_CACHE_TTL)
 
 
 def create_article(event, context):
-    authenticatedUser = user.authenticate_and_get_user(event)
+    authenticatedUser = user.authenticate_and_get_user(event, user.USER_PROFILE)
     if authenticatedUser is None:
         return envelop("Must be logged in", 422)
 
-    body = json.loads(event["body"])
+    body = parse_body(event)
     if "article" not in body:
         return envelop("Article must be specified", 422)
 
@@ -38,14 +46,22 @@ def create_article(event, context):
         "createdAt": timestamp,
         "updatedAt": timestamp,
         "author": authenticatedUser["username"],
-        "dummy": "partition",
+        "dummy": timeline_shard(zlib.crc32(slug.encode()) % TIMELINE_SHARDS),
         "favoritesCount": 0,
     }
 
     if "tagList" in article_val:
+        if not is_tag_list(article_val["tagList"]):
+            return envelop("tagList must be a list of strings", 422)
         item["tagList"] = article_val["tagList"]
 
     articles_table.put_item(Item=item)
+    if FEED_STRATEGY == "table":
+        followers = user.get_followers(authenticatedUser["username"])
+        feed.fan_out_article(item, followers)
+    article_index.add_tags(item, item.get("tagList", []))
+    if item.get("tagList"):
+        tags_cache.invalidate()
 
     del item["dummy"]
     item["tagList"] = article_val.get("tagList", [])
@@ -63,6 +79,15 @@ def create_article(event, context):
     return envelop({"article": item})
 
 
+def is_tag_list(tags):
+    return isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)
+
+
+# Shard 0 keeps the original key so articles written before sharding stay listed
+def timeline_shard(index):
+    return "partition" if index == 0 else f"partition-{index}"
+
+
 def get_article(event, context):
     if "slug" not in event["pathParameters"]:
         return envelop("Slug must be specified", 422)
@@ -73,9 +98,12 @@ def get_article(event, context):
         return envelop(f"Article not found: {slug}", 422)
 
     article = result["Item"]
-    authenticated_user = user.authenticate_and_get_user(event)
+    authenticated_user = user.authenticate_and_get_user(
+        event, user.USER_IDENTITY, read_only=True
+    )
     return envelop(
-        {"article": transform_retrieved_article(article, authenticated_user)}
+        {"article": transform_retrieved_article(article, authenticated_user)},
+        event=event,
     )
 
 
@@ -86,42 +114,84 @@ def get_article_by_slug(slug):
     return result["Item"]
 
 
-def transform_retrieved_article(article, authenticated_user):
+# Batched article reads, returned in the order of the given slugs
+def get_articles_by_slugs(slugs):
+    keys = [{"slug": slug} for slug in slugs]
+    if not keys:
+        return []
+    articles = {
+        article["slug"]: article
+        for article in batch_get_items(db.typed, articles_table.name, keys)
+    }
+    return [articles[slug] for slug in slugs if slug in articles]
+
+
+def transform_retrieved_article(
+    article, authenticated_user, author_profiles=None, favorited_slugs=None
+):
     del article["dummy"]
     article["tagList"] = article.get("tagList", [])
     article["favoritesCount"] = article.get("favoritesCount", 0)
     article["favorited"] = False
+    if authenticated_user:
+        if favorited_slugs is None:
+            article["favorited"] = article_index.is_favorited(
+                authenticated_user["username"], article
+            )
+        else:
+            article["favorited"] = article["slug"] in favorited_slugs
+    article.pop("favoritedBy", None)
     article["createdAt"] = (
-        datetime.fromtimestamp(article["createdAt"]).isoformat() + ".000Z"
+        datetime.fromtimestamp(int(article["createdAt"])).isoformat() + ".000Z"
     )
     article["updatedAt"] = (
-        datetime.fromtimestamp(article["updatedAt"]).isoformat() + ".000Z"
-    )
-    if "favoritedBy" in article:
-        if authenticated_user:
-            article["favorited"] = (
-                authenticated_user["username"] in article["favoritedBy"]
-            )
-        del article["favoritedBy"]
-    article["author"] = user.get_profile_by_username(
-        article["author"], authenticated_user
+        datetime.fromtimestamp(int(article["updatedAt"])).isoformat() + ".000Z"
     )
+    if author_profiles is None:
+        article["author"] = user.get_profile_by_username(
+            article["author"], authenticated_user
+        )
+    else:
+        article["author"] = author_profiles.get(article["author"])
     return article
 
 
+# Transform a page of articles, resolving all authors and favorites with
+# batched reads
+def transform_retrieved_articles(articles, authenticated_user):
+    author_profiles = user.get_profiles_by_usernames(
+        {article["author"] for article in articles}, authenticated_user
+    )
+    favorited_slugs = set()
+    if authenticated_user:
+        favorited_slugs = article_index.get_favorited_slugs(
+            authenticated_user["username"], articles
+        )
+    return [
+        transform_retrieved_article(
+            article, authenticated_user, author_profiles, favorited_slugs
+        )
+        for article in articles
+    ]
+
+
 def update_article(event, context):
 
-    body = json.loads(event["body"])
+    body = parse_body(event)
     if "article" not in body:
         return envelop("Article must be specified", 422)
     article_mutation = body["article"]
 
-    if all(item not in article_mutation for item in ["title", "description", "body"]):
+    fields = ["title", "description", "body", "tagList"]
+    if all(item not in article_mutation for item in fields):
         return envelop(
-            "At least one field must be specified: [title, description, body].", 422
+            "At least one field must be specified: [title, description, body, tagList].",
+            422,
         )
+    if "tagList" in article_mutation and not is_tag_list(article_mutation["tagList"]):
+        return envelop("tagList must be a list of strings", 422)
 
-    authenticated_user = user.authenticate_and_get_user(event)
+    authenticated_user = user.authenticate_and_get_user(event, user.USER_IDENTITY)
     if authenticated_user is None:
         return envelop("Must be logged in", 422)
 
@@ -139,11 +209,29 @@ def update_article(event, context):
             f"Article can only be updated by author: {article['author']}", 422
         )
 
-    for field in ["title", "description", "body"]:
-        if field in article_mutation:
-            article[field] = article_mutation[field]
-    article["updatedAt"] = int(datetime.utcnow().timestamp())
-    articles_table.put_item(Item=article)
+    # Only the changed fields are written, so concurrent favorites are kept
+    changes = {
+        field: article_mutation[field] for field in fields if field in article_mutation
+    }
+    changes["updatedAt"] = int(datetime.utcnow().timestamp())
+    old_tags = set(article.get("tagList", []))
+    article.update(changes)
+    new_tags = set(article.get("tagList", []))
+    # The condition keeps a concurrent delete from leaving a partial article
+    try:
+        articles_table.update_item(
+            Key={"slug": slug},
+            UpdateExpression="SET " + ", ".join(f"#{f} = :{f}" for f in changes),
+            ConditionExpression="attribute_exists(slug)",
+            ExpressionAttributeNames={f"#{f}": f for f in changes},
+            ExpressionAttributeValues={f":{f}": value for f, value in changes.items()},
+        )
+    except db.get_raw_client().exceptions.ConditionalCheckFailedException:
+        return envelop(f"Article not found: {slug}", 422)
+    article_index.add_tags(article, new_tags - old_tags)
+    article_index.remove_tags(article, old_tags - new_tags)
+    if new_tags != old_tags:
+        tags_cache.invalidate()
 
     return envelop(
         {"article": transform_retrieved_article(article, authenticated_user)}
@@ -151,7 +239,7 @@ def update_article(event, context):
 
 
 def delete_article(event, context):
-    authenticated_user = user.authenticate_and_get_user(event)
+    authenticated_user = user.authenticate_and_get_user(event, user.USER_IDENTITY)
     if authenticated_user is None:
         return envelop("Must be logged in", 422)
     slug = event["pathParameters"].get("slug")
@@ -166,11 +254,18 @@ def delete_article(event, context):
             f"Article can only be deleted by author: {article['author']}", 422
         )
     articles_table.delete_item(Key={"slug": slug})
+    if FEED_STRATEGY == "table":
+        followers = user.get_followers(authenticated_user["username"])
+        feed.remove_article(article, followers)
+    article_index.remove_tags(article, article.get("tagList", []))
+    if article.get("tagList"):
+        tags_cache.invalidate()
+    article_index.remove_favorites(article)
     return envelop({})
 
 
 def favorite_article(event, context):
-    authenticated_user = user.authenticate_and_get_user(event)
+    authenticated_user = user.authenticate_and_get_user(event, user.USER_IDENTITY)
     if authenticated_user is None:
         return envelop("Must be logged in", 422)
     slug = event["pathParameters"].get("slug")
@@ -182,22 +277,10 @@ def favorite_article(event, context):
         return envelop(f"Article not found: {slug}", 422)
 
     shouldFavorite = event["httpMethod"] != "DELETE"
-    if shouldFavorite:
-        article.setdefault("favoritedBy", [])
-        if authenticated_user["username"] not in article["favoritedBy"]:
-            article["favoritedBy"].append(authenticated_user["username"])
-            article["favoritesCount"] += 1
-    elif (
-        "favoritedBy" in article
-        and authenticated_user["username"] in article["favoritedBy"]
+    if article_index.set_favorite(
+        authenticated_user["username"], article, shouldFavorite
     ):
-        article["favoritedBy"].remove(authenticated_user["username"])
-        article["favoritesCount"] -= 1
-        if len(article["favoritedBy"]) == 0:
-            del article["favoritedBy"]
-            article["favoritesCount"] = 0
-
-    articles_table.put_item(Item=article)
+        article["favoritesCount"] += 1 if shouldFavorite else -1
 
     return envelop(
         {"article": transform_retrieved_article(article, authenticated_user)}
@@ -205,104 +288,246 @@ def favorite_article(event, context):
 
 
 def list_articles(event, context):
-    authenticated_user = user.authenticate_and_get_user(event)
+    authenticated_user = user.authenticate_and_get_user(
+        event, user.USER_IDENTITY, read_only=True
+    )
     params = event.get("queryStringParameters", {})
     if params == None:
         params = {}
-    limit = params.get("limit", 20)
-    if type(limit) != int:
-        limit = 20
-    limit = int(limit)
-    offset = params.get("offset", 0)
-    if type(offset) != int:
-        offset = 0
-    offset = int(offset)
+    limit, offset = page_params(params)
     if sum(item in params for item in ["tag", "author", "favorited"]) > 1:
         return envelop("Use only one of tag, author, or favorited", 422)
-    queryParams = {
-        "KeyConditionExpression": Key("dummy").eq("partition"),
-        "ScanIndexForward": False,
-        "IndexName": "createdAt",
-    }
-    if "tag" in params:
-        queryParams["FilterExpression"] = "contains(tagList, :tag)"
-        queryParams["ExpressionAttributeValues"] = {":tag": params["tag"]}
-    elif "author" in params:
-        queryParams["FilterExpression"] = "author = :author"
-        queryParams["ExpressionAttributeValues"] = {":author": params["author"]}
-    elif "favorited" in params:
-        queryParams["FilterExpression"] = "contains(favoritedBy, :favorited)"
-        queryParams["ExpressionAttributeValues"] = {":favorited": params["favorited"]}
 
+    plan = plan_article_query(params)
+    logging.info(f"list_articles plan: {plan}")
+
+    # A cursor resumes where the previous page ended; offset is only kept
+    # for clients that do not send one
+    position = None
+    if params.get("cursor"):
+        try:
+            position = pagination.resume_cursor(params["cursor"], plan)
+        except ValueError:
+            return envelop("Invalid cursor", 422)
+        offset = 0
+    articles, position = run_article_query(plan, limit, offset, position)
     return envelop(
         {
-            "articles": queryEnoughArticles(
-                queryParams, authenticated_user, limit, offset
-            )
-        }
+            "articles": transform_retrieved_articles(articles, authenticated_user),
+            "nextCursor": pagination.next_cursor(plan, position),
+        },
+        event=event,
     )
 
 
-def get_article_by_author(author):
-    queryParams = {
-        "ScanIndexForward": False,
-        "IndexName": "author",
-        "KeyConditionExpression": Key("author").eq(author),
-    }
-    queryResult = articles_table.query(**queryParams)
-    return queryResult.get("Items", [])
+# Pick the cheapest access path for a listing: every filter has its own keyed
+# index, only unfiltered listings read the sharded timeline
+def plan_article_query(params):
+    if "tag" in params:
+        return {"path": "tag-index", "tag": params["tag"]}
+    if "favorited" in params:
+        return {"path": "favorites-index", "username": params["favorited"]}
+    if "author" in params:
+        return {"path": "author-index", "author": params["author"]}
+    return {"path": "timeline", "shards": TIMELINE_MAX_SHARDS}
+
+
+# Returns the articles and the position to continue from, None at the end
+def run_article_query(plan, limit, offset, position=None):
+    if plan["path"] == "tag-index":
+        entries, position = article_index.query_tag(
+            plan["tag"], limit, offset, position
+        )
+    elif plan["path"] == "favorites-index":
+        entries, position = article_index.query_favorited(
+            plan["username"], limit, offset, position
+        )
+    elif plan["path"] == "author-index":
+        return query_author(plan["author"], limit, offset, position)
+    else:
+        return query_timeline(limit, offset, position)
+    return get_articles_by_slugs([entry["slug"] for entry in entries]), position
+
+
+# Lazily page through a query, starting from an already fetched first page
+def iter_query(queryParams, queryResult):
+    queryParams = dict(queryParams)
+    while True:
+        yield from queryResult["Items"]
+        if "LastEvaluatedKey" not in queryResult:
+            break
+        queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
+        queryResult = articles_table.query(**queryParams)
+
+
+# Fetch the first page of every query in parallel and return lazy streams.
+# Queries must use string expressions: the condition builder is not thread safe.
+def scatter_queries(queryParamsList):
+    if len(queryParamsList) <= 1:
+        return [iter_query(p, articles_table.query(**p)) for p in queryParamsList]
+    workers = min(len(queryParamsList), SCATTER_MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        queryResults = list(
+            executor.map(lambda p: articles_table.query(**p), queryParamsList)
+        )
+    return [iter_query(p, r) for p, r in zip(queryParamsList, queryResults)]
+
+
+# Merge newest first named streams and keep the items between offset and
+# offset + limit. positions holds, per stream, the key of its last consumed
+# item and is advanced in place; streams must start after those keys.
+def merge_streams(streams, limit, offset, positions, key_attributes):
+    tagged = [tag_stream(name, stream) for name, stream in streams.items()]
+    merged = heapq.merge(*tagged, key=lambda x: x[1]["createdAt"], reverse=True)
+    page = []
+    for index, (name, item) in enumerate(itertools.islice(merged, offset + limit)):
+        positions[name] = {attribute: item[attribute] for attribute in key_attributes}
+        if index >= offset:
+            page.append(item)
+    return page
+
+
+def tag_stream(name, stream):
+    for item in stream:
+        yield name, item
+
+
+# Query parameters that resume a stream after its last consumed item
+def resume_stream(queryParams, positions, name):
+    if name in positions:
+        return dict(queryParams, ExclusiveStartKey=positions[name])
+    return queryParams
+
+
+# K-way merge of the followed authors' streams, stopping after offset + limit.
+# The position is the last consumed key per author; a full, non-empty page
+# continues.
+def merge_feed(follow_list, limit, offset, positions=None):
+    positions = dict(positions or {})
+    page_size = max(1, min(offset + limit, FEED_MERGE_PAGE_SIZE))
+    queryParamsList = [
+        resume_stream(
+            {
+                "ScanIndexForward": False,
+                "IndexName": "author",
+                "KeyConditionExpression": "author = :author",
+                "ExpressionAttributeValues": {":author": author},
+                "Limit": page_size,
+            },
+            positions,
+            author,
+        )
+        for author in follow_list
+    ]
+    streams = dict(zip(follow_list, scatter_queries(queryParamsList)))
+    page = merge_streams(
+        streams, limit, offset, positions, ["slug", "author", "createdAt"]
+    )
+    return page, positions if page and len(page) == limit else None
 
 
 def get_feed(event, context):
-    authenticated_user = user.authenticate_and_get_user(event)
+    authenticated_user = user.authenticate_and_get_user(
+        event, user.USER_IDENTITY, read_only=True
+    )
     if authenticated_user is None:
         return envelop("Must be logged in", 422)
     params = event.get("queryStringParameters", {})
     if params is None:
         params = {}
-    limit = int(params.get("limit", 20))
-    offset = int(params.get("offset", 0))
-    follow_list = user.get_followed_users(authenticated_user["username"])
-    articles_ret = []
-    for username in follow_list:
-        articles_ret.extend(get_article_by_author(username))
-    articles_ret.sort(key=lambda x: x["createdAt"], reverse=True)
-    articles_ret = list(
-        map(
-            lambda x: transform_retrieved_article(x, authenticated_user),
-            articles_ret[offset : offset + limit],
+    limit, offset = page_params(params)
+    listing = {
+        "path": f"feed-{FEED_STRATEGY}",
+        "username": authenticated_user["username"],
+    }
+    position = None
+    if params.get("cursor"):
+        try:
+            position = pagination.resume_cursor(params["cursor"], listing)
+        except ValueError:
+            return envelop("Invalid cursor", 422)
+        offset = 0
+    if FEED_STRATEGY == "merge":
+        follow_list = user.get_followed_users(authenticated_user["username"])
+        articles_ret, position = merge_feed(follow_list, limit, offset, position)
+    else:
+        entries, position = feed.query_feed(
+            authenticated_user["username"], limit, offset, position
         )
+        articles_ret = get_articles_by_slugs([entry["slug"] for entry in entries])
+    articles_ret = transform_retrieved_articles(articles_ret, authenticated_user)
+    return envelop(
+        {
+            "articles": articles_ret,
+            "nextCursor": pagination.next_cursor(listing, position),
+        },
+        event=event,
     )
-    return envelop({"articles": articles_ret})
 
 
 def get_tags(event, context):
-    uniqTags = set()
-    scanParam = {
-        "AttributesToGet": ["tagList"],
-    }
-    while True:
-        scanResult = articles_table.scan(**scanParam)
-        for item in scanResult["Items"]:
-            if "tagList" in item:
-                uniqTags.update(item["tagList"])
-        if "LastEvaluatedKey" not in scanResult:
-            break
-        scanParam["ExclusiveStartKey"] = scanResult["LastEvaluatedKey"]
-    return envelop({"tags": list(uniqTags)})
+    tags = tags_cache.get("tags")
+    if tags is None:
+        tags = article_index.query_tags()
+        if len(tags) <= TAG_CACHE_MAX_TAGS:
+            tags_cache.set("tags", tags)
+    return envelop({"tags": tags}, event=event)
+
+
+def get_tags_cache_stats():
+    return tags_cache.stats()
+
+
+# Maintenance handler, invoked manually to rebuild the tag aggregate
+def rebuild_tags(event, context):
+    counts = article_index.rebuild_tags()
+    tags_cache.invalidate()
+    return envelop({"tags": len(counts)})
+
+
+# Maintenance handler, invoked once to move the favoritedBy lists of older
+# articles into the favorites table
+def migrate_favorites(event, context):
+    return envelop({"articles": article_index.migrate_favorites()})
+
+
+# Scatter the timeline query over every shard and gather the newest articles.
+# The position is the last consumed key per shard; a full, non-empty page
+# continues.
+def query_timeline(limit, offset, positions=None):
+    positions = dict(positions or {})
+    shards = [timeline_shard(index) for index in range(TIMELINE_MAX_SHARDS)]
+    queryParamsList = [
+        resume_stream(
+            {
+                "ScanIndexForward": False,
+                "IndexName": "createdAt",
+                "KeyConditionExpression": "dummy = :shard",
+                "ExpressionAttributeValues": {":shard": shard},
+                "Limit": max(1, offset + limit),
+            },
+            positions,
+            shard,
+        )
+        for shard in shards
+    ]
+    streams = dict(zip(shards, scatter_queries(queryParamsList)))
+    page = merge_streams(
+        streams, limit, offset, positions, ["slug", "dummy", "createdAt"]
+    )
+    return page, positions if page and len(page) == limit else None
 
 
-def queryEnoughArticles(queryParams, authenticatedUser, limit, offset):
-    queryResultItems = []
-    while len(queryResultItems) < limit + offset:
-        print(queryParams)
-        queryResult = articles_table.query(**queryParams)
-        queryResultItems.extend(queryResult["Items"])
-        if "LastEvaluatedKey" not in queryResult:
-            break
-        else:
-            queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
-    articleRet = []
-    for article in queryResultItems[offset : offset + limit]:
-        articleRet.append(transform_retrieved_article(article, authenticatedUser))
-    return articleRet
+# Newest first articles of one author after start_key, reading only
+# offset + limit of them
+def query_author(author, limit, offset, start_key=None):
+    queryParams = {
+        "ScanIndexForward": False,
+        "IndexName": "author",
+        "KeyConditionExpression": "author = :author",
+        "ExpressionAttributeValues": {":author": author},
+    }
+    articles, last_key = query_page(
+        articles_table, queryParams, offset + limit, start_key
+    )
+    return articles[offset:], last_key
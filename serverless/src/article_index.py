@@ -0,0 +1,234 @@
+import src.db as db
+from collections import Counter
+from boto3.dynamodb.conditions import Key
+from src.util import *
+
+dynamodb = db.dynamodb
+article_tags_table = db.table("article-tags")
+tags_table = db.table("tags")
+articles_table = db.table("articles")
+favorites_table = db.table("favorites")
+
+
+def add_tags(article, tags):
+    count_tags(tags, 1)
+    with article_tags_table.batch_writer() as batch:
+        for tag in set(tags):
+            batch.put_item(
+                Item={
+                    "tag": tag,
+                    "indexKey": article_entry_key(article),
+                    "slug": article["slug"],
+                    "createdAt": article["createdAt"],
+                }
+            )
+
+
+def remove_tags(article, tags):
+    count_tags(tags, -1)
+    with article_tags_table.batch_writer() as batch:
+        for tag in set(tags):
+            batch.delete_item(Key={"tag": tag, "indexKey": article_entry_key(article)})
+
+
+# Atomically adjust the article count of every tag, dropping unused tags
+def count_tags(tags, delta):
+    for tag in set(tags):
+        key = {"dummy": "partition", "tag": tag}
+        result = tags_table.update_item(
+            Key=key,
+            UpdateExpression="ADD articlesCount :delta",
+            ExpressionAttributeValues={":delta": delta},
+            ReturnValues="UPDATED_NEW",
+        )
+        if result["Attributes"]["articlesCount"] <= 0:
+            try:
+                tags_table.delete_item(
+                    Key=key,
+                    ConditionExpression="articlesCount <= :zero",
+                    ExpressionAttributeValues={":zero": 0},
+                )
+            except tags_table.meta.client.exceptions.ConditionalCheckFailedException:
+                pass
+
+
+# All tags in use, most used first
+def query_tags():
+    queryParams = {"KeyConditionExpression": Key("dummy").eq("partition")}
+    tags = []
+    while True:
+        queryResult = tags_table.query(**queryParams)
+        tags.extend(queryResult["Items"])
+        if "LastEvaluatedKey" not in queryResult:
+            break
+        queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
+    tags.sort(key=lambda x: (-x["articlesCount"], x["tag"]))
+    return [tag["tag"] for tag in tags if tag["articlesCount"] > 0]
+
+
+# Recount every tag and rewrite the tag index from a parallel scan of the
+# articles, e.g. for articles written before the aggregate existed
+def rebuild_tags():
+    counts = Counter()
+    articles = parallel_scan(
+        articles_table,
+        SCAN_SEGMENTS,
+        ProjectionExpression="slug, createdAt, tagList",
+    )
+    with article_tags_table.batch_writer() as batch:
+        for article in articles:
+            for tag in set(article.get("tagList", [])):
+                counts[tag] += 1
+                batch.put_item(
+                    Item={
+                        "tag": tag,
+                        "indexKey": article_entry_key(article),
+                        "slug": article["slug"],
+                        "createdAt": article["createdAt"],
+                    }
+                )
+    stale_tags = set(query_tags()) - set(counts)
+    with tags_table.batch_writer() as batch:
+        for tag, count in counts.items():
+            batch.put_item(
+                Item={"dummy": "partition", "tag": tag, "articlesCount": count}
+            )
+        for tag in stale_tags:
+            batch.delete_item(Key={"dummy": "partition", "tag": tag})
+    return counts
+
+
+# Move the favoritedBy lists that articles kept before the favorites table
+# into favorite items, and recount favoritesCount from the items of those
+# articles. Favorites made while this runs can be off by one until the next
+# favorite of the same article.
+def migrate_favorites():
+    articles = parallel_scan(
+        articles_table,
+        SCAN_SEGMENTS,
+        ProjectionExpression="slug, createdAt, favoritedBy",
+        FilterExpression="attribute_exists(favoritedBy)",
+    )
+    migrated = 0
+    for article in articles:
+        with favorites_table.batch_writer() as batch:
+            for username in set(article["favoritedBy"]):
+                batch.put_item(
+                    Item={
+                        "username": username,
+                        "indexKey": article_entry_key(article),
+                        "slug": article["slug"],
+                        "createdAt": article["createdAt"],
+                    }
+                )
+        try:
+            articles_table.update_item(
+                Key={"slug": article["slug"]},
+                UpdateExpression="SET favoritesCount = :count REMOVE favoritedBy",
+                ConditionExpression="attribute_exists(slug)",
+                ExpressionAttributeValues={":count": count_favorites(article)},
+            )
+            migrated += 1
+        except db.get_raw_client().exceptions.ConditionalCheckFailedException:
+            remove_favorites(article)
+    return migrated
+
+
+def count_favorites(article):
+    queryParams = {
+        "IndexName": "article",
+        "KeyConditionExpression": Key("slug").eq(article["slug"]),
+        "Select": "COUNT",
+    }
+    count = 0
+    while True:
+        queryResult = favorites_table.query(**queryParams)
+        count += queryResult["Count"]
+        if "LastEvaluatedKey" not in queryResult:
+            return count
+        queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
+
+
+# Add or remove a favorite and adjust favoritesCount in one transaction. The
+# conditions turn repeated requests into no-ops; returns whether it changed.
+# Concurrent favorites of the same article are retried, never dropped.
+def set_favorite(username, article, favorite):
+    key = {"username": username, "indexKey": article_entry_key(article)}
+    if favorite:
+        favorite_write = {
+            "Put": {
+                "TableName": favorites_table.name,
+                "Item": dict(key, slug=article["slug"], createdAt=article["createdAt"]),
+                "ConditionExpression": "attribute_not_exists(username)",
+            }
+        }
+    else:
+        favorite_write = {
+            "Delete": {
+                "TableName": favorites_table.name,
+                "Key": key,
+                "ConditionExpression": "attribute_exists(username)",
+            }
+        }
+    count_update = {
+        "Update": {
+            "TableName": articles_table.name,
+            "Key": {"slug": article["slug"]},
+            "UpdateExpression": "ADD favoritesCount :delta",
+            "ConditionExpression": "attribute_exists(slug)",
+            "ExpressionAttributeValues": {":delta": 1 if favorite else -1},
+        }
+    }
+    writes = [favorite_write, count_update]
+    return transact_conditional_writes(dynamodb.meta.client, writes) is None
+
+
+def is_favorited(username, article):
+    result = favorites_table.get_item(
+        Key={"username": username, "indexKey": article_entry_key(article)},
+        ProjectionExpression="slug",
+    )
+    return "Item" in result
+
+
+# Slugs of the given articles that the user has favorited, in batched reads
+def get_favorited_slugs(username, articles):
+    keys = [
+        {"username": username, "indexKey": article_entry_key(article)}
+        for article in articles
+    ]
+    if not keys:
+        return set()
+    favorites = batch_get_items(
+        dynamodb, favorites_table.name, keys, ProjectionExpression="slug"
+    )
+    return {favorite["slug"] for favorite in favorites}
+
+
+# Drop every favorite of a deleted article, found through the article index
+def remove_favorites(article):
+    queryParams = {
+        "IndexName": "article",
+        "KeyConditionExpression": Key("slug").eq(article["slug"]),
+        "ProjectionExpression": "username, indexKey",
+    }
+    with favorites_table.batch_writer() as batch:
+        while True:
+            queryResult = favorites_table.query(**queryParams)
+            for entry in queryResult["Items"]:
+                batch.delete_item(Key=entry)
+            if "LastEvaluatedKey" not in queryResult:
+                break
+            queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
+
+
+def query_tag(tag, limit, offset, start_key=None):
+    return query_newest_first(
+        article_tags_table, Key("tag").eq(tag), limit, offset, start_key
+    )
+
+
+def query_favorited(username, limit, offset, start_key=None):
+    return query_newest_first(
+        favorites_table, Key("username").eq(username), limit, offset, start_key
+    )
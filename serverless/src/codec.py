@@ -0,0 +1,180 @@
+from decimal import Decimal
+from operator import itemgetter
+from boto3.dynamodb.conditions import ConditionExpressionBuilder
+from boto3.dynamodb.types import Binary
+
+# Converts between DynamoDB attribute values and plain Python values for the
+# low-level client. Whole numbers come back as int, other numbers as Decimal,
+# binary as bytes.
+
+
+def to_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return Decimal(text)
+
+
+def decode_value(value):
+    ((kind, data),) = value.items()
+    return VALUE_DECODERS[kind](data)
+
+
+VALUE_DECODERS = {
+    "S": str,
+    "N": to_number,
+    "B": bytes,
+    "BOOL": bool,
+    "NULL": lambda data: None,
+    "L": lambda data: [decode_value(value) for value in data],
+    "M": lambda data: {name: decode_value(value) for name, value in data.items()},
+    "SS": set,
+    "NS": lambda data: {to_number(text) for text in data},
+    "BS": lambda data: {bytes(blob) for blob in data},
+}
+
+# Field decoders for the item shapes we store. A field holding another type
+# than expected raises KeyError and is decoded generically instead.
+string = itemgetter("S")
+binary = itemgetter("B")
+
+
+def number(value):
+    return to_number(value["N"])
+
+
+def string_list(value):
+    return [element["S"] for element in value["L"]]
+
+
+ARTICLE = {
+    "slug": string,
+    "title": string,
+    "description": string,
+    "body": string,
+    "author": string,
+    "dummy": string,
+    "createdAt": number,
+    "updatedAt": number,
+    "favoritesCount": number,
+    "tagList": string_list,
+}
+USER = {
+    "username": string,
+    "email": string,
+    "password": binary,
+    "bio": string,
+    "image": string,
+}
+COMMENT = {
+    "id": string,
+    "slug": string,
+    "body": string,
+    "author": string,
+    "createdAt": number,
+    "updatedAt": number,
+}
+
+# Item shapes by table, without the namespace prefix
+SCHEMAS = {"articles": ARTICLE, "users": USER, "comments": COMMENT}
+
+
+def decode_item(item, schema={}):
+    decoded = {}
+    for name, value in item.items():
+        decoder = schema.get(name, decode_value)
+        try:
+            decoded[name] = decoder(value)
+        except KeyError:
+            decoded[name] = decode_value(value)
+    return decoded
+
+
+def encode_value(value):
+    encoder = VALUE_ENCODERS.get(type(value))
+    if encoder is None:
+        for value_type, type_encoder in VALUE_ENCODERS.items():
+            if isinstance(value, value_type):
+                encoder = type_encoder
+                break
+        else:
+            raise TypeError(f"Unsupported type {type(value)} for value {value!r}")
+    return encoder(value)
+
+
+def encode_set(values):
+    if all(isinstance(value, str) for value in values):
+        return {"SS": list(values)}
+    if all(isinstance(value, (bytes, bytearray)) for value in values):
+        return {"BS": [bytes(value) for value in values]}
+    return {"NS": [encode_number(value)["N"] for value in values]}
+
+
+def encode_number(value):
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    return {"N": str(value)}
+
+
+# bool is checked before int by the exact type lookup in encode_value
+VALUE_ENCODERS = {
+    str: lambda value: {"S": value},
+    bool: lambda value: {"BOOL": value},
+    int: encode_number,
+    Decimal: encode_number,
+    type(None): lambda value: {"NULL": True},
+    bytes: lambda value: {"B": value},
+    bytearray: lambda value: {"B": bytes(value)},
+    Binary: lambda value: {"B": value.value},
+    list: lambda value: {"L": [encode_value(element) for element in value]},
+    tuple: lambda value: {"L": [encode_value(element) for element in value]},
+    dict: lambda value: {"M": encode_item(value)},
+    set: encode_set,
+    frozenset: encode_set,
+    float: encode_number,
+}
+
+
+def encode_item(item):
+    return {name: encode_value(value) for name, value in item.items()}
+
+
+ITEM_PARAMS = ["Key", "Item", "ExclusiveStartKey", "ExpressionAttributeValues"]
+RESPONSE_ITEMS = ["Item", "Attributes", "LastEvaluatedKey"]
+# Condition parameters and whether they take key conditions
+CONDITION_PARAMS = {
+    "KeyConditionExpression": True,
+    "FilterExpression": False,
+    "ConditionExpression": False,
+}
+
+
+# Turn resource-style Table parameters into low-level client parameters
+def encode_request(params):
+    request = dict(params)
+    builder = ConditionExpressionBuilder()
+    for param, is_key_condition in CONDITION_PARAMS.items():
+        condition = request.get(param)
+        if condition is None or isinstance(condition, str):
+            continue
+        built = builder.build_expression(condition, is_key_condition)
+        request[param] = built.condition_expression
+        for placeholders, values in [
+            ("ExpressionAttributeNames", built.attribute_name_placeholders),
+            ("ExpressionAttributeValues", built.attribute_value_placeholders),
+        ]:
+            if values:
+                request[placeholders] = dict(request.get(placeholders, {}), **values)
+    for param in ITEM_PARAMS:
+        if param in request:
+            request[param] = encode_item(request[param])
+    return request
+
+
+def decode_response(response, schema={}):
+    for name in RESPONSE_ITEMS:
+        if name in response:
+            response[name] = decode_item(response[name], schema)
+    if "Items" in response:
+        response["Items"] = [decode_item(item, schema) for item in response["Items"]]
+    return response
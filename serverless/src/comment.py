@@ -1,23 +1,24 @@
 import json
-import boto3
+import src.db as db
 import logging
 import uuid
 from datetime import datetime
 from boto3.dynamodb.conditions import Key, Attr
 import src.user as User
 import src.article as Article
+import src.pagination as pagination
 from src.util import *
 
-dynamodb = boto3.resource("dynamodb", region_name="ap-northeast-2")
-comments_table = dynamodb.Table("dev-comments")
+dynamodb = db.dynamodb
+comments_table = db.table("comments")
 
 
 def create(event, context):
-    authenticatedUser = User.authenticate_and_get_user(event)
+    authenticatedUser = User.authenticate_and_get_user(event, User.USER_PROFILE)
     if authenticatedUser is None:
         return envelop("Must be logged in", 422)
 
-    body = json.loads(event["body"])
+    body = parse_body(event)
     if "comment" not in body:
         return envelop("Comment must be specified", 422)
 
@@ -53,7 +54,9 @@ def create(event, context):
 
 
 def get(event, context):
-    authenticated_user = User.authenticate_and_get_user(event)
+    authenticated_user = User.authenticate_and_get_user(
+        event, User.USER_IDENTITY, read_only=True
+    )
     slug = event.get("pathParameters", {}).get("slug")
     if slug is None:
         return envelop("Article slug must be specified", 422)
@@ -61,26 +64,45 @@ def get(event, context):
     if article is None:
         return envelop(f"Article not found", 422)
 
-    comments = comments_table.query(
-        IndexName="article",
-        KeyConditionExpression=Key("slug").eq(slug),
+    queryParams = {
+        "IndexName": "article",
+        "KeyConditionExpression": Key("slug").eq(slug),
+    }
+
+    # Pages are only cut when asked for with limit or cursor
+    params = event.get("queryStringParameters") or {}
+    paginated = "limit" in params or "cursor" in params
+    if paginated:
+        limit, _ = page_params(params)
+        listing = {"path": "comments", "slug": slug}
+        position = None
+        if params.get("cursor"):
+            try:
+                position = pagination.resume_cursor(params["cursor"], listing)
+            except ValueError:
+                return envelop("Invalid cursor", 422)
+        comments, position = query_page(comments_table, queryParams, limit, position)
+    else:
+        comments = comments_table.query(**queryParams).get("Items", [])
+    author_profiles = User.get_profiles_by_usernames(
+        {comment["author"] for comment in comments}, authenticated_user
     )
-    comments = comments.get("Items", [])
     for comment in comments:
-        comment["author"] = User.get_profile_by_username(
-            comment["author"], authenticated_user
-        )
+        comment["author"] = author_profiles.get(comment["author"])
         comment["createdAt"] = (
-            datetime.utcfromtimestamp(comment["createdAt"]).isoformat() + ".000Z"
+            datetime.utcfromtimestamp(int(comment["createdAt"])).isoformat() + ".000Z"
         )
         comment["updatedAt"] = (
-            datetime.utcfromtimestamp(comment["updatedAt"]).isoformat() + ".000Z"
+            datetime.utcfromtimestamp(int(comment["updatedAt"])).isoformat() + ".000Z"
         )
-    return envelop({"comments": comments})
+    if paginated:
+        nextCursor = pagination.next_cursor(listing, position)
+        return envelop({"comments": comments, "nextCursor": nextCursor}, event=event)
+    return envelop({"comments": comments}, event=event)
 
 
 def delete(event, context):
-    authenticated_user = User.authenticate_and_get_user(event)
+    authenticated_user = User.authenticate_and_get_user(event, User.USER_IDENTITY)
     if authenticated_user is None:
         return envelop("Must be logged in", 422)
 
@@ -0,0 +1,139 @@
+import threading
+import boto3
+from botocore.config import Config
+from src.util import *
+import src.codec as codec
+
+# One DynamoDB resource and one plain client per container, shared by every
+# handler module and built on first use instead of at import time. Typed
+# tables use the plain client, everything else the resource; each keeps its
+# own connection pool.
+config = Config(
+    region_name=DYNAMODB_REGION,
+    max_pool_connections=DB_MAX_POOL_CONNECTIONS,
+    connect_timeout=DB_CONNECT_TIMEOUT,
+    read_timeout=DB_READ_TIMEOUT,
+    retries={"max_attempts": DB_MAX_ATTEMPTS, "mode": "standard"},
+    tcp_keepalive=True,
+)
+lock = threading.Lock()
+resources = {}
+tables = {}
+
+
+def get_resource():
+    if "dynamodb" not in resources:
+        with lock:
+            if "dynamodb" not in resources:
+                resources["dynamodb"] = boto3.resource("dynamodb", config=config)
+    return resources["dynamodb"]
+
+
+def get_client():
+    return get_resource().meta.client
+
+
+# Plain client without the resource marshalling, used with src.codec
+def get_raw_client():
+    if "client" not in resources:
+        with lock:
+            if "client" not in resources:
+                resources["client"] = boto3.client("dynamodb", config=config)
+    return resources["client"]
+
+
+# Table handle for a table of this stage, e.g. table("users") -> dev-users.
+# Tables with a known item shape go through the plain client and src.codec.
+def table(name):
+    full_name = f"{DYNAMODB_NAMESPACE}-{name}"
+    if full_name not in tables:
+        if name in codec.SCHEMAS:
+            tables[full_name] = TypedTable(full_name, codec.SCHEMAS[name])
+        else:
+            tables[full_name] = LazyTable(full_name)
+    return tables[full_name]
+
+
+# Stands in for the resource until an attribute is used
+class LazyResource:
+    def __getattr__(self, attr):
+        return getattr(get_resource(), attr)
+
+
+# Stands in for a Table; the name is known up front so building request
+# parameters does not construct anything
+class LazyTable:
+    def __init__(self, name):
+        self.name = name
+        self.table = None
+
+    def __getattr__(self, attr):
+        if self.table is None:
+            self.table = get_resource().Table(self.name)
+        return getattr(self.table, attr)
+
+
+# Same calls as a resource Table, condition objects included, on the plain
+# client. Numbers come back as int where they are whole.
+class TypedTable:
+    def __init__(self, name, schema):
+        self.name = name
+        self.schema = schema
+
+    def get_item(self, **params):
+        return self.call("get_item", params)
+
+    def put_item(self, **params):
+        return self.call("put_item", params)
+
+    def update_item(self, **params):
+        return self.call("update_item", params)
+
+    def delete_item(self, **params):
+        return self.call("delete_item", params)
+
+    def query(self, **params):
+        return self.call("query", params)
+
+    def scan(self, **params):
+        return self.call("scan", params)
+
+    def call(self, operation, params):
+        request = codec.encode_request(params)
+        request["TableName"] = self.name
+        response = getattr(get_raw_client(), operation)(**request)
+        return codec.decode_response(response, self.schema)
+
+
+# batch_get_item for batch_get_items on the plain client. Items of known
+# tables are decoded with their shape.
+class TypedClient:
+    def batch_get_item(self, RequestItems):
+        request_items = {
+            table_name: dict(
+                request, Keys=[codec.encode_item(key) for key in request["Keys"]]
+            )
+            for table_name, request in RequestItems.items()
+        }
+        result = get_raw_client().batch_get_item(RequestItems=request_items)
+        responses = {
+            table_name: [
+                codec.decode_item(item, schema_of(table_name)) for item in items
+            ]
+            for table_name, items in result.get("Responses", {}).items()
+        }
+        unprocessed = {
+            table_name: dict(
+                request, Keys=[codec.decode_item(key) for key in request["Keys"]]
+            )
+            for table_name, request in result.get("UnprocessedKeys", {}).items()
+        }
+        return {"Responses": responses, "UnprocessedKeys": unprocessed}
+
+
+def schema_of(table_name):
+    return codec.SCHEMAS.get(table_name[len(DYNAMODB_NAMESPACE) + 1 :], {})
+
+
+dynamodb = LazyResource()
+typed = TypedClient()
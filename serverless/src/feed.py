@@ -0,0 +1,74 @@
+import src.db as db
+from boto3.dynamodb.conditions import Key
+from src.util import *
+
+dynamodb = db.dynamodb
+feeds_table = db.table("feeds")
+articles_table = db.table("articles")
+
+
+def feed_entry(follower, article):
+    return {
+        "username": follower,
+        "feedKey": article_entry_key(article),
+        "slug": article["slug"],
+        "author": article["author"],
+        "createdAt": article["createdAt"],
+    }
+
+
+# Write a new article into the feed of every follower of its author
+def fan_out_article(article, followers):
+    with feeds_table.batch_writer() as batch:
+        for follower in followers:
+            batch.put_item(Item=feed_entry(follower, article))
+
+
+def remove_article(article, followers):
+    with feeds_table.batch_writer() as batch:
+        for follower in followers:
+            batch.delete_item(
+                Key={"username": follower, "feedKey": article_entry_key(article)}
+            )
+
+
+# Copy the newest articles of a newly followed author into the feed. Older
+# articles are left out to keep the follow request short.
+def add_author(follower, author):
+    queryParams = {
+        "IndexName": "author",
+        "KeyConditionExpression": Key("author").eq(author),
+        "ScanIndexForward": False,
+        "ProjectionExpression": "slug, author, createdAt",
+    }
+    articles, _ = query_page(articles_table, queryParams, FEED_BACKFILL_LIMIT)
+    with feeds_table.batch_writer() as batch:
+        for article in articles:
+            batch.put_item(Item=feed_entry(follower, article))
+
+
+# Drop the articles of an unfollowed author from the feed. The author's
+# articles are listed through the author index, so the rest of the feed is
+# never read.
+def remove_author(follower, author):
+    queryParams = {
+        "IndexName": "author",
+        "KeyConditionExpression": Key("author").eq(author),
+        "ProjectionExpression": "slug, createdAt",
+    }
+    with feeds_table.batch_writer() as batch:
+        while True:
+            queryResult = articles_table.query(**queryParams)
+            for article in queryResult["Items"]:
+                batch.delete_item(
+                    Key={"username": follower, "feedKey": article_entry_key(article)}
+                )
+            if "LastEvaluatedKey" not in queryResult:
+                break
+            queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
+
+
+def query_feed(username, limit, offset, start_key=None):
+    return query_newest_first(
+        feeds_table, Key("username").eq(username), limit, offset, start_key
+    )
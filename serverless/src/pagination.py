@@ -0,0 +1,46 @@
+import base64
+import hashlib
+import hmac
+from src.util import *
+
+SIGNATURE_BYTES = 16
+
+# Cursors are opaque to clients: the position to resume a listing from (a
+# LastEvaluatedKey, or one per merged stream), tied to the listing it came
+# from and signed, so they cannot be used to start queries at arbitrary keys.
+
+
+def next_cursor(listing, position):
+    if position is None:
+        return None
+    return encode_cursor({"listing": listing, "position": position})
+
+
+# Position stored in a cursor of this listing; ValueError for anything else
+def resume_cursor(cursor, listing):
+    state = decode_cursor(cursor)
+    if state.get("listing") != listing:
+        raise ValueError("Cursor belongs to another listing")
+    return state["position"]
+
+
+def encode_cursor(state):
+    payload = encode_json(state).encode()
+    token = sign(payload) + payload
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except (TypeError, ValueError):
+        raise ValueError("Malformed cursor")
+    signature, payload = token[:SIGNATURE_BYTES], token[SIGNATURE_BYTES:]
+    if not hmac.compare_digest(signature, sign(payload)):
+        raise ValueError("Cursor signature mismatch")
+    return json.loads(payload)
+
+
+def sign(payload):
+    digest = hmac.new(CURSOR_SECRET_KEY.encode(), payload, hashlib.sha256).digest()
+    return digest[:SIGNATURE_BYTES]
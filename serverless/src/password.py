@@ -0,0 +1,34 @@
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+from src.util import *
+
+# bcrypt releases the GIL while hashing, so checks submitted together run in
+# parallel on the pool
+executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS)
+
+
+def hash_password(password):
+    salt = bcrypt.gensalt(BCRYPT_ROUNDS)
+    return executor.submit(bcrypt.hashpw, password.encode(), salt).result()
+
+
+def check_password(password, hashed):
+    return check_passwords([(password, hashed)])[0]
+
+
+# Verify many (password, hash) pairs at once
+def check_passwords(pairs):
+    return list(
+        executor.map(
+            lambda pair: bcrypt.checkpw(pair[0].encode(), bytes(pair[1])), pairs
+        )
+    )
+
+
+# Work factor of a stored hash, e.g. 12 for b"$2b$12$..."
+def hash_cost(hashed):
+    return int(bytes(hashed).split(b"$")[2])
+
+
+def needs_rehash(hashed):
+    return hash_cost(hashed) != BCRYPT_ROUNDS
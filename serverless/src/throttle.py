@@ -0,0 +1,70 @@
+import src.db as db
+import hashlib
+import time
+from src.util import *
+
+dynamodb = db.dynamodb
+throttle_table = db.table("login-throttle")
+
+# Recent wrong passwords of this container, by digest of the email, the
+# password and the stored hash they were checked against
+failure_cache = TTLCache(maxsize=LOGIN_FAILURE_CACHE_SIZE, ttl=LOGIN_FAILURE_CACHE_TTL)
+
+
+def login_subjects(email, source_ip):
+    subjects = {f"email#{email}": LOGIN_MAX_FAILURES_PER_EMAIL}
+    if source_ip:
+        subjects[f"source#{source_ip}"] = LOGIN_MAX_FAILURES_PER_SOURCE
+    return subjects
+
+
+# Failure counters live in fixed windows. The sliding window estimate adds the
+# previous window weighted by how much of it still overlaps the last
+# LOGIN_WINDOW_SECONDS.
+def is_throttled(email, source_ip):
+    now = time.time()
+    window = int(now // LOGIN_WINDOW_SECONDS)
+    overlap = 1 - (now % LOGIN_WINDOW_SECONDS) / LOGIN_WINDOW_SECONDS
+    subjects = login_subjects(email, source_ip)
+    keys = [
+        {"throttleKey": f"{subject}#{w}"}
+        for subject in subjects
+        for w in [window, window - 1]
+    ]
+    counters = batch_get_items(
+        dynamodb,
+        throttle_table.name,
+        keys,
+        ProjectionExpression="throttleKey, failures",
+    )
+    failures = {c["throttleKey"]: int(c["failures"]) for c in counters}
+    for subject, limit in subjects.items():
+        current = failures.get(f"{subject}#{window}", 0)
+        previous = failures.get(f"{subject}#{window - 1}", 0)
+        if current + previous * overlap >= limit:
+            return True
+    return False
+
+
+def record_failure(email, source_ip):
+    window = int(time.time() // LOGIN_WINDOW_SECONDS)
+    expires_at = (window + 2) * LOGIN_WINDOW_SECONDS
+    for subject in login_subjects(email, source_ip):
+        throttle_table.update_item(
+            Key={"throttleKey": f"{subject}#{window}"},
+            UpdateExpression="ADD failures :one SET expiresAt = :expiresAt",
+            ExpressionAttributeValues={":one": 1, ":expiresAt": expires_at},
+        )
+
+
+# A changed password has a new hash, so it never matches an older entry
+def record_wrong_password(email, password, hashed):
+    failure_cache.set(failure_digest(email, password, hashed), True)
+
+
+def is_known_wrong_password(email, password, hashed):
+    return failure_cache.get(failure_digest(email, password, hashed)) is not None
+
+
+def failure_digest(email, password, hashed):
+    return hashlib.sha256(f"{email}\0{password}\0".encode() + hashed).digest()
@@ -0,0 +1,113 @@
+import binascii
+import hashlib
+import hmac
+import json
+import time
+from calendar import timegm
+from datetime import datetime
+import jwt
+from jwt.exceptions import DecodeError, ExpiredSignatureError, InvalidSignatureError
+from jwt.utils import base64url_decode, base64url_encode
+
+HMAC_HASHES = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+# Registered claims the fast path does not validate itself
+GENERIC_CLAIMS = {"iat", "nbf", "aud", "iss"}
+
+
+# Header segment exactly as jwt.encode writes it for our tokens
+def header_segment(algorithm):
+    header = {"typ": "JWT", "alg": algorithm}
+    return base64url_encode(
+        json.dumps(header, separators=(",", ":"), sort_keys=True).encode()
+    )
+
+
+# Verifier for the tokens minted by this service, built once per container.
+# The keyed HMAC is copied for every token instead of re-preparing the key,
+# the header is compared against the one segment we issue and only exp is
+# checked. Anything else goes through jwt.decode, so results are identical.
+class TokenVerifier:
+    def __init__(self, key, algorithm):
+        self.key = key
+        self.algorithm = algorithm
+        self.header_segment = header_segment(algorithm)
+        self.mac = None
+        if algorithm in HMAC_HASHES:
+            self.mac = hmac.new(key.encode(), digestmod=HMAC_HASHES[algorithm])
+
+    def decode(self, token):
+        if self.mac is None or not isinstance(token, str):
+            return self.generic_decode(token)
+        token = token.encode()
+        try:
+            signing_input, crypto_segment = token.rsplit(b".", 1)
+            header, payload_segment = signing_input.split(b".", 1)
+        except ValueError as err:
+            raise DecodeError("Not enough segments") from err
+        if header != self.header_segment:
+            return self.generic_decode(token)
+
+        try:
+            payload_data = base64url_decode(payload_segment)
+        except (TypeError, binascii.Error) as err:
+            raise DecodeError("Invalid payload padding") from err
+        try:
+            signature = base64url_decode(crypto_segment)
+        except (TypeError, binascii.Error) as err:
+            raise DecodeError("Invalid crypto padding") from err
+
+        mac = self.mac.copy()
+        mac.update(signing_input)
+        if not hmac.compare_digest(signature, mac.digest()):
+            raise InvalidSignatureError("Signature verification failed")
+
+        try:
+            payload = json.loads(payload_data)
+        except ValueError as e:
+            raise DecodeError(f"Invalid payload string: {e}")
+        if not isinstance(payload, dict):
+            raise DecodeError("Invalid payload string: must be a json object")
+        if not GENERIC_CLAIMS.isdisjoint(payload):
+            return self.generic_decode(token)
+
+        if "exp" in payload:
+            try:
+                exp = int(payload["exp"])
+            except ValueError:
+                raise DecodeError("Expiration Time claim (exp) must be an integer.")
+            if exp <= time.time():
+                raise ExpiredSignatureError("Signature has expired")
+        return payload
+
+    def generic_decode(self, token):
+        return jwt.decode(token, self.key, [self.algorithm])
+
+
+# Signer producing the same tokens as jwt.encode. The header segment and the
+# keyed HMAC are prepared once, so each call only serializes the payload.
+class TokenSigner:
+    def __init__(self, key, algorithm):
+        self.key = key
+        self.algorithm = algorithm
+        self.header_segment = header_segment(algorithm)
+        self.mac = None
+        if algorithm in HMAC_HASHES:
+            self.mac = hmac.new(key.encode(), digestmod=HMAC_HASHES[algorithm])
+
+    def encode(self, payload):
+        if self.mac is None:
+            return jwt.encode(payload, self.key, self.algorithm)
+        payload = payload.copy()
+        for time_claim in ["exp", "iat", "nbf"]:
+            if isinstance(payload.get(time_claim), datetime):
+                payload[time_claim] = timegm(payload[time_claim].utctimetuple())
+        json_payload = json.dumps(payload, separators=(",", ":")).encode()
+        signing_input = self.header_segment + b"." + base64url_encode(json_payload)
+        mac = self.mac.copy()
+        mac.update(signing_input)
+        return (signing_input + b"." + base64url_encode(mac.digest())).decode()
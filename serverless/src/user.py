@@ -1,19 +1,41 @@
 import logging
-import boto3
+import hashlib
+import time
+import src.db as db
 from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime, timedelta
-import jwt
-import bcrypt
 from src.util import *
+import src.feed as feed
+import src.tokens as tokens
+import src.password as password
+import src.throttle as throttle
 import json
 
-dynamodb = boto3.resource("dynamodb", region_name="ap-northeast-2")
-users_table = dynamodb.Table("dev-users")
+dynamodb = db.dynamodb
+users_table = db.table("users")
+follows_table = db.table("follows")
+# One item per email address, claimed by the user that registered it
+emails_table = db.table("emails")
+
+# Attribute sets for user reads, so handlers only fetch what they use.
+# Full reads (attributes=None) are reserved for read-modify-write updates.
+USER_IDENTITY = ("username",)
+USER_PROFILE = ("username", "bio", "image")
+USER_ACCOUNT = ("username", "email", "bio", "image")
+USER_CREDENTIALS = ("username", "email", "password", "bio", "image")
+
+# Verified token claims by token digest, kept until the token expires
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+token_verifier = tokens.TokenVerifier(JWT_SECRET_KEY, JWT_ALGORITHM)
+token_signer = tokens.TokenSigner(JWT_SECRET_KEY, JWT_ALGORITHM)
+
+# Username by email, checked against the user item on every hit
+email_cache = TTLCache(maxsize=EMAIL_CACHE_SIZE, ttl=EMAIL_CACHE_TTL)
 
 
 # create user
 def create_user(event, context):
-    body = json.loads(event["body"])
+    body = parse_body(event)
     # input validation
     if "user" not in body:
         return envelop("User must be specified.", 422)
@@ -28,26 +50,31 @@ def create_user(event, context):
         logging.error("Validation Failed")
         return envelop("Password must be specified.", 422)
 
-    # Verify username is not taken
-    user_exists = get_user_by_username(user["username"])
-    if user_exists:
-        logging.error("Validation Failed")
-        return envelop(f"Username already taken: {user['username']}", 422)
-
-    # Verify email is not taken
-    email_exists = get_user_by_email(user["email"])
-    if email_exists["Count"]:
-        logging.error("Validation Failed")
-        return envelop(f"Email already taken: {user['email']}", 422)
-
-    # Add new entry to usersTable
-    encryptedPassword = bcrypt.hashpw(user["password"].encode(), bcrypt.gensalt())
+    # Add new entry to usersTable and claim the email in the same write, so
+    # a taken username or email cancels the whole registration
+    claim_legacy_email(user["email"])
+    encryptedPassword = password.hash_password(user["password"])
     item = {
         "username": user["username"],
         "email": user["email"],
         "password": encryptedPassword,
     }
-    users_table.put_item(Item=item)
+    user_write = {
+        "Put": {
+            "TableName": users_table.name,
+            "Item": item,
+            "ConditionExpression": "attribute_not_exists(username)",
+        }
+    }
+    failed = transact_conditional_writes(
+        dynamodb.meta.client, [user_write, claim_email(item)]
+    )
+    if failed == 0:
+        logging.error("Validation Failed")
+        return envelop(f"Username already taken: {user['username']}", 422)
+    if failed == 1:
+        logging.error("Validation Failed")
+        return envelop(f"Email already taken: {user['email']}", 422)
 
     # Return user info with jwt token
     user = {
@@ -63,33 +90,103 @@ def create_user(event, context):
 
 def mint_token(a_username):
     payload = {"username": a_username, "exp": datetime.utcnow() + timedelta(days=2)}
-    jwt_token = jwt.encode(payload, JWT_SECRET_KEY, JWT_ALGORITHM)
+    jwt_token = token_signer.encode(payload)
     return jwt_token
 
 
-def get_user_by_username(username):
+def claim_email(user):
+    return {
+        "Put": {
+            "TableName": emails_table.name,
+            "Item": {"email": user["email"], "username": user["username"]},
+            "ConditionExpression": "attribute_not_exists(email)",
+        }
+    }
+
+
+# Claim the email of a user registered before email claims existed, so the
+# claim in a following transaction fails. Not needed once migrate_emails ran.
+def claim_legacy_email(a_email):
+    if EMAIL_CLAIM_FALLBACK:
+        get_unclaimed_user_by_email(a_email, USER_IDENTITY)
+
+
+# Give up an email claim, unless another user holds it
+def release_email(user):
+    return {
+        "Delete": {
+            "TableName": emails_table.name,
+            "Key": {"email": user["email"]},
+            "ConditionExpression": "attribute_not_exists(email) OR username = :username",
+            "ExpressionAttributeValues": {":username": user["username"]},
+        }
+    }
+
+
+def get_user_by_username(username, attributes=None):
+    getParams = {"Key": {"username": username}}
+    if attributes:
+        getParams.update(projection(attributes))
     try:
-        response = users_table.get_item(Key={"username": username})["Item"]
+        response = users_table.get_item(**getParams)["Item"]
     except Exception as e:
         response = None
     return response
 
 
-def get_user_by_email(a_email):
-    response = users_table.query(
-        IndexName="email",
-        KeyConditionExpression="email= :email",
-        ExpressionAttributeValues={
+# Find a user through the email claim items. A username cached for the email
+# is used only while the user still has that email.
+def get_user_by_email(a_email, attributes=None):
+    if attributes and "email" not in attributes:
+        attributes = tuple(attributes) + ("email",)
+    username = email_cache.get(a_email)
+    if username is not None:
+        user = get_user_by_username(username, attributes)
+        if user is not None and user["email"] == a_email:
+            return user
+        email_cache.invalidate(a_email)
+
+    claim = emails_table.get_item(
+        Key={"email": a_email}, ConsistentRead=True, ProjectionExpression="username"
+    )
+    if "Item" in claim:
+        user = get_user_by_username(claim["Item"]["username"], attributes)
+    else:
+        user = get_unclaimed_user_by_email(a_email, attributes)
+    if user is not None:
+        email_cache.set(a_email, user["username"])
+    return user
+
+
+# Users registered before email claims existed are found through the email
+# index, and their email is claimed on the way
+def get_unclaimed_user_by_email(a_email, attributes=None):
+    queryParams = {
+        "IndexName": "email",
+        "KeyConditionExpression": "email= :email",
+        "ExpressionAttributeValues": {
             ":email": a_email,
         },
-        Select="ALL_ATTRIBUTES",
-    )
-    return response
+        "Select": "ALL_ATTRIBUTES",
+    }
+    if attributes:
+        queryParams.update(projection(attributes), Select="SPECIFIC_ATTRIBUTES")
+    users = users_table.query(**queryParams)["Items"]
+    if not users:
+        return None
+    try:
+        emails_table.put_item(
+            Item={"email": a_email, "username": users[0]["username"]},
+            ConditionExpression="attribute_not_exists(email)",
+        )
+    except emails_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+    return users[0]
 
 
 # login user
 def login_user(event, context):
-    body = json.loads(event["body"])
+    body = parse_body(event)
 
     # input validation
     if "user" not in body:
@@ -103,24 +200,49 @@ def login_user(event, context):
         logging.error("Validation Failed")
         return envelop("Password must be specified.", 422)
 
+    # Reject throttled attempts before paying for bcrypt
+    source_ip = event.get("requestContext", {}).get("identity", {}).get("sourceIp")
+    if throttle.is_throttled(user["email"], source_ip):
+        return envelop("Too many failed login attempts. Try again later.", 429)
+
     # Get user with this email
-    user_with_this_email = get_user_by_email(user["email"])
-    if user_with_this_email["Count"] == 0:
+    user_with_this_email = get_user_by_email(user["email"], USER_CREDENTIALS)
+    if user_with_this_email is None:
+        throttle.record_failure(user["email"], source_ip)
         return envelop(f"Email not found: {user['email']}.", 422)
 
-    # Check password
-    if not bcrypt.checkpw(
-        user["password"].encode(), bytes(user_with_this_email["Items"][0]["password"])
-    ):
+    # Check password, unless it recently failed against the same stored hash
+    stored_password = user_with_this_email["password"]
+    if throttle.is_known_wrong_password(
+        user["email"], user["password"], stored_password
+    ) or not password.check_password(user["password"], stored_password):
+        throttle.record_failure(user["email"], source_ip)
+        throttle.record_wrong_password(user["email"], user["password"], stored_password)
         return envelop("Wrong password.", 422)
 
+    # Upgrade hashes made with a different work factor while we know the
+    # password. A user deleted in the meantime is not written back.
+    if password.needs_rehash(stored_password):
+        try:
+            users_table.update_item(
+                Key={"username": user_with_this_email["username"]},
+                UpdateExpression="SET #password = :password",
+                ConditionExpression="attribute_exists(username)",
+                ExpressionAttributeNames={"#password": "password"},
+                ExpressionAttributeValues={
+                    ":password": password.hash_password(user["password"])
+                },
+            )
+        except db.get_raw_client().exceptions.ConditionalCheckFailedException:
+            pass
+
     # Return user with jwt token
     authenticated_user = {
         "email": user["email"],
-        "token": mint_token(user_with_this_email["Items"][0]["username"]),
-        "username": user_with_this_email["Items"][0]["username"],
-        "bio": user_with_this_email["Items"][0].get("bio", ""),
-        "image": user_with_this_email["Items"][0].get("image", ""),
+        "token": mint_token(user_with_this_email["username"]),
+        "username": user_with_this_email["username"],
+        "bio": user_with_this_email.get("bio", ""),
+        "image": user_with_this_email.get("image", ""),
     }
 
     return envelop({"user": authenticated_user})
@@ -128,7 +250,7 @@ def login_user(event, context):
 
 # get user
 def get_user(event, context):
-    authenticated_user = authenticate_and_get_user(event)
+    authenticated_user = authenticate_and_get_user(event, USER_ACCOUNT)
     if authenticated_user is None:
         return envelop("Token not present or invalid.", 422)
     user = {
@@ -147,24 +269,25 @@ def update_user(event, context):
     if not authenticated_user:
         return envelop("Token not present or invalid.", 422)
     updated_user = authenticated_user
-    body = json.loads(event["body"])
+    body = parse_body(event)
 
     if "user" not in body:
         logging.error("Validation Failed")
         return envelop("User must be specified.", 422)
     user = body["user"]
 
-    if "email" in user:
-        # Verify email is not taken
-        user_with_this_email = get_user_by_email(user["email"])
-        if user_with_this_email["Count"] != 0:
-            return envelop(f"Email already taken: {user['email']}", 422)
+    # A changed email moves the claim along with the user write
+    writes = []
+    if "email" in user and user["email"] != updated_user.get("email"):
+        if "email" in updated_user:
+            writes.append(release_email(updated_user))
+            email_cache.invalidate(updated_user["email"])
         updated_user["email"] = user["email"]
+        claim_legacy_email(user["email"])
+        writes.append(claim_email(updated_user))
 
     if "password" in user:
-        updated_user["password"] = bcrypt.hashpw(
-            user["password"].encode(), bcrypt.gensalt()
-        )
+        updated_user["password"] = password.hash_password(user["password"])
 
     if "image" in user:
         updated_user["image"] = user["image"]
@@ -172,7 +295,9 @@ def update_user(event, context):
     if "bio" in user:
         updated_user["bio"] = user["bio"]
 
-    users_table.put_item(Item=updated_user)
+    writes.append({"Put": {"TableName": users_table.name, "Item": updated_user}})
+    if transact_conditional_writes(dynamodb.meta.client, writes) is not None:
+        return envelop(f"Email already taken: {user['email']}", 422)
 
     del updated_user["password"]
     updated_user["token"] = get_token_from_event(event)
@@ -182,64 +307,45 @@ def update_user(event, context):
 
 def get_profile(event, context):
     username = event["pathParameters"]["username"]
-    authenticated_user = authenticate_and_get_user(event)
+    authenticated_user = authenticate_and_get_user(event, USER_IDENTITY, read_only=True)
     profile = get_profile_by_username(username, authenticated_user)
 
     if profile is None:
         return envelop(f"User not found: {username}", 422)
 
-    return envelop({"profile": profile})
+    return envelop({"profile": profile}, event=event)
 
 
 def follow(event, context):
-    authenticated_user = authenticate_and_get_user(event)
+    authenticated_user = authenticate_and_get_user(event, USER_IDENTITY)
     if authenticated_user is None:
         return envelop("Token not present or invalid.", 422)
 
     username = event["pathParameters"]["username"]
-    user = get_user_by_username(username)
+    user = get_user_by_username(username, USER_PROFILE)
+    if user is None:
+        return envelop(f"User not found: {username}", 422)
     should_follow = event["httpMethod"] != "DELETE"
 
-    # Update "followers" field on followed user
-    if should_follow:
-        if (
-            "followers" in user
-            and authenticated_user["username"] not in user["followers"]
-        ):
-            user["followers"].append(authenticated_user["username"])
+    # The follow edge is written conditionally, so repeated requests change
+    # nothing and the feed is only touched when the edge actually changed.
+    # The merge strategy reads feeds from the articles and keeps no rows.
+    edge = {"follower": authenticated_user["username"], "followee": username}
+    try:
+        if should_follow:
+            follows_table.put_item(
+                Item=edge, ConditionExpression="attribute_not_exists(follower)"
+            )
+            if FEED_STRATEGY == "table":
+                feed.add_author(authenticated_user["username"], username)
         else:
-            user.setdefault("followers", [authenticated_user["username"]])
-    else:
-        if "followers" in user and authenticated_user["username"] in user["followers"]:
-            user["followers"].remove(authenticated_user["username"])
-
-            # delete followers if list is empty
-            if len(user["followers"]) == 0:
-                del user["followers"]
-
-    users_table.put_item(Item=user)
-
-    # Update "following" field on follower user
-    if should_follow:
-        if (
-            "following" in authenticated_user
-            and username not in authenticated_user["following"]
-        ):
-            authenticated_user["following"].append(username)
-        else:
-            authenticated_user.setdefault("following", [username])
-    else:
-        if (
-            "following" in authenticated_user
-            and username in authenticated_user["following"]
-        ):
-            authenticated_user["following"].remove(username)
-
-            # delete following if list is empty
-            if len(authenticated_user["following"]) == 0:
-                del authenticated_user["following"]
-
-    users_table.put_item(Item=authenticated_user)
+            follows_table.delete_item(
+                Key=edge, ConditionExpression="attribute_exists(follower)"
+            )
+            if FEED_STRATEGY == "table":
+                feed.remove_author(authenticated_user["username"], username)
+    except follows_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
 
     profile = {
         "username": username,
@@ -252,11 +358,81 @@ def follow(event, context):
 
 
 def get_followed_users(a_username):
-    user = users_table.get_item(Key={"username": a_username})
-    if "Item" not in user:
-        return envelop("User not found", 422)
-    user = user["Item"]
-    return user.get("following", [])
+    return query_follow_edges(
+        "followee", KeyConditionExpression=Key("follower").eq(a_username)
+    )
+
+
+def get_followers(a_username):
+    return query_follow_edges(
+        "follower",
+        IndexName="followee",
+        KeyConditionExpression=Key("followee").eq(a_username),
+    )
+
+
+def query_follow_edges(attribute, **queryParams):
+    queryParams["ProjectionExpression"] = attribute
+    usernames = []
+    while True:
+        queryResult = follows_table.query(**queryParams)
+        usernames.extend(edge[attribute] for edge in queryResult["Items"])
+        if "LastEvaluatedKey" not in queryResult:
+            break
+        queryParams["ExclusiveStartKey"] = queryResult["LastEvaluatedKey"]
+    return usernames
+
+
+def is_following(a_follower, a_followee):
+    edge = follows_table.get_item(
+        Key={"follower": a_follower, "followee": a_followee},
+        ProjectionExpression="followee",
+    )
+    return "Item" in edge
+
+
+# Maintenance handler, invoked once to claim the emails of users registered
+# before email claims existed. Afterwards EMAIL_CLAIM_FALLBACK can be turned
+# off. Emails already claimed are left to their claim.
+def migrate_emails(event, context):
+    users = parallel_scan(
+        users_table, SCAN_SEGMENTS, ProjectionExpression="username, email"
+    )
+    claimed = 0
+    for user in users:
+        if "email" not in user:
+            continue
+        try:
+            emails_table.put_item(
+                Item={"email": user["email"], "username": user["username"]},
+                ConditionExpression="attribute_not_exists(email)",
+            )
+            claimed += 1
+        except emails_table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+    return envelop({"claimed": claimed})
+
+
+# Maintenance handler, invoked once to move the follow lists that users kept
+# before the follows table into edge items. Both lists are read so that an
+# edge recorded on only one side is kept. Rewriting an edge is harmless.
+def migrate_follows(event, context):
+    users = parallel_scan(
+        users_table,
+        SCAN_SEGMENTS,
+        ProjectionExpression="username, following, followers",
+    )
+    edges = set()
+    for user in users:
+        edges.update((user["username"], name) for name in user.get("following", []))
+        edges.update((name, user["username"]) for name in user.get("followers", []))
+    with follows_table.batch_writer() as batch:
+        for follower, followee in edges:
+            batch.put_item(Item={"follower": follower, "followee": followee})
+    if FEED_STRATEGY == "table":
+        for follower, followee in edges:
+            feed.add_author(follower, followee)
+    return envelop({"follows": len(edges)})
 
 
 def get_token_from_event(event):
@@ -264,31 +440,115 @@ def get_token_from_event(event):
 
 
 def get_profile_by_username(a_username, a_authenticated_user):
-    user = get_user_by_username(a_username)
+    user = get_user_by_username(a_username, USER_PROFILE)
     if user is None:
         return None
+    following = False
+    if a_authenticated_user:
+        following = is_following(a_authenticated_user["username"], a_username)
+    return build_profile(user, following)
+
+
+# Resolve the profiles of many users with batched reads, keyed by username
+def get_profiles_by_usernames(a_usernames, a_authenticated_user):
+    keys = [{"username": username} for username in a_usernames]
+    if not keys:
+        return {}
+    users = batch_get_items(
+        db.typed, users_table.name, keys, **projection(USER_PROFILE)
+    )
+
+    # If user is authenticated, set following bits from the follow edges
+    followed = set()
+    if a_authenticated_user:
+        edge_keys = [
+            {"follower": a_authenticated_user["username"], "followee": user["username"]}
+            for user in users
+        ]
+        edges = batch_get_items(
+            dynamodb, follows_table.name, edge_keys, ProjectionExpression="followee"
+        )
+        followed = {edge["followee"] for edge in edges}
+    return {
+        user["username"]: build_profile(user, user["username"] in followed)
+        for user in users
+    }
+
+
+def build_profile(user, following):
     profile = {
         "username": user["username"],
         "bio": user.get("bio", ""),
         "image": user.get("image", ""),
-        "following": False,
+        "following": following,
     }
     if profile["image"] == "":
         del profile["image"]
 
-    # If user is authenticated, set following bit
-    if "followers" in user and a_authenticated_user:
-        profile["following"] = a_authenticated_user["username"] in user["followers"]
-
     return profile
 
 
-def authenticate_and_get_user(event):
+# Read-only handlers may pass read_only=True to trust the verified claims
+# alone. Handlers that write always check that the user still exists.
+def authenticate_and_get_user(event, attributes=None, read_only=False):
     try:
         token = get_token_from_event(event)
-        decoded = jwt.decode(token, JWT_SECRET_KEY, JWT_ALGORITHM)
+        decoded = decode_token(token)
         username = decoded["username"]
-        authenticated_user = get_user_by_username(username)
+
+        # The verified claims already hold everything the caller asked for
+        if (
+            STATELESS_AUTH
+            and read_only
+            and attributes
+            and set(attributes) <= set(decoded)
+        ):
+            return ClaimsUser(
+                {attribute: decoded[attribute] for attribute in attributes}
+            )
+
+        authenticated_user = get_user_by_username(username, attributes)
         return authenticated_user
     except Exception as e:
         return None
+
+
+def decode_token(token):
+    digest = hashlib.sha256(token.encode()).digest()
+    decoded = token_cache.get(digest)
+    if decoded is None:
+        decoded = token_verifier.decode(token)
+        ttl = TOKEN_CACHE_TTL
+        if "exp" in decoded:
+            ttl = min(ttl, decoded["exp"] - time.time())
+        token_cache.set(digest, decoded, ttl)
+    return dict(decoded)
+
+
+def get_token_cache_stats():
+    return token_cache.stats()
+
+
+# Authenticated user built from verified token claims. Attributes beyond the
+# claims are loaded from the users table the first time they are accessed.
+class ClaimsUser(dict):
+    loaded = False
+
+    def __missing__(self, key):
+        self.load()
+        if key not in self:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key not in self:
+            self.load()
+        return dict.get(self, key, default)
+
+    def load(self):
+        if not self.loaded:
+            self.loaded = True
+            username = dict.__getitem__(self, "username")
+            user = get_user_by_username(username, USER_ACCOUNT)
+            if user is not None:
+                self.update(user)
@@ -1,15 +1,124 @@
+import base64
+import gzip
+import hashlib
 import logging
 import json
+import os
+import queue
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 JWT_SECRET_KEY = "sample_secret_key"
 JWT_ALGORITHM = "HS256"
 
+# Signs pagination cursors, which carry table keys
+CURSOR_SECRET_KEY = os.environ.get("CURSOR_SECRET_KEY", JWT_SECRET_KEY)
+
+# Trust verified token claims instead of reading the user item when a read-only
+# handler only needs attributes carried by the token
+STATELESS_AUTH = os.environ.get("STATELESS_AUTH", "true").lower() == "true"
+
+# Verified tokens cached per container, never past their exp claim
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 256))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 3600))
+
+# bcrypt work factor for new hashes; older hashes are upgraded on login
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", 4))
+
+# Usernames of recently used emails, per container
+EMAIL_CACHE_SIZE = int(os.environ.get("EMAIL_CACHE_SIZE", 1024))
+EMAIL_CACHE_TTL = float(os.environ.get("EMAIL_CACHE_TTL", 300))
+# Users registered before email claims have no claim item until migrateEmails
+# has run; until then new emails are also looked up in the email index
+EMAIL_CLAIM_FALLBACK = os.environ.get("EMAIL_CLAIM_FALLBACK", "true").lower() == "true"
+
+# Failed logins allowed per email and per source IP within the sliding window
+# before login_user rejects attempts without checking the password
+LOGIN_WINDOW_SECONDS = int(os.environ.get("LOGIN_WINDOW_SECONDS", 300))
+LOGIN_MAX_FAILURES_PER_EMAIL = int(os.environ.get("LOGIN_MAX_FAILURES_PER_EMAIL", 5))
+LOGIN_MAX_FAILURES_PER_SOURCE = int(os.environ.get("LOGIN_MAX_FAILURES_PER_SOURCE", 20))
+LOGIN_FAILURE_CACHE_SIZE = 1024
+LOGIN_FAILURE_CACHE_TTL = 60
+
+# "table" reads the materialized feed, "merge" merges the followed authors'
+# article streams on read and needs no feed table
+FEED_STRATEGY = os.environ.get("FEED_STRATEGY", "table")
+FEED_MERGE_PAGE_SIZE = int(os.environ.get("FEED_MERGE_PAGE_SIZE", 10))
+# Newest articles of a newly followed author copied into the feed table
+FEED_BACKFILL_LIMIT = int(os.environ.get("FEED_BACKFILL_LIMIT", 50))
+
+# Number of hash keys new articles are spread over on the global timeline.
+# Reads always cover TIMELINE_MAX_SHARDS keys, so TIMELINE_SHARDS can be
+# lowered again without hiding the articles already on the higher shards.
+TIMELINE_MAX_SHARDS = 8
+TIMELINE_SHARDS = int(os.environ.get("TIMELINE_SHARDS", 4))
+if not 1 <= TIMELINE_SHARDS <= TIMELINE_MAX_SHARDS:
+    raise ValueError(f"TIMELINE_SHARDS must be between 1 and {TIMELINE_MAX_SHARDS}")
+SCATTER_MAX_WORKERS = 16
+
+# Warm containers serve get_tags from memory for this many seconds
+TAG_CACHE_TTL = float(os.environ.get("TAG_CACHE_TTL", 60))
+TAG_CACHE_MAX_TAGS = int(os.environ.get("TAG_CACHE_MAX_TAGS", 10000))
+
+# Largest page a listing returns, whatever limit the client asks for
+PAGE_MAX_LIMIT = int(os.environ.get("PAGE_MAX_LIMIT", 100))
+
+# Number of parallel segments used for full-table scans
+SCAN_SEGMENTS = int(os.environ.get("SCAN_SEGMENTS", 8))
+
+# Tables are named "<namespace>-<table>", the namespace being the stage
+DYNAMODB_NAMESPACE = os.environ.get("DYNAMODB_NAMESPACE", "dev")
+DYNAMODB_REGION = os.environ.get("DYNAMODB_REGION", "ap-northeast-2")
+
+# Connection pool sized for the scatter and scan threads, standard retries
+DB_MAX_POOL_CONNECTIONS = int(os.environ.get("DB_MAX_POOL_CONNECTIONS", 32))
+DB_MAX_ATTEMPTS = int(os.environ.get("DB_MAX_ATTEMPTS", 3))
+DB_CONNECT_TIMEOUT = float(os.environ.get("DB_CONNECT_TIMEOUT", 2))
+DB_READ_TIMEOUT = float(os.environ.get("DB_READ_TIMEOUT", 10))
+
+# "auto" encodes responses with orjson when the layer has it, "json" always
+# uses the standard library
+JSON_ENCODER = os.environ.get("JSON_ENCODER", "auto")
+
+# Successful bodies at least this large are compressed when the client
+# accepts it; brotli is preferred when the layer has it
+COMPRESSION_MIN_BYTES = int(os.environ.get("COMPRESSION_MIN_BYTES", 1024))
+# Media types API Gateway passes through as binary; must match
+# apiGateway.binaryMediaTypes in serverless.yml
+BINARY_MEDIA_TYPES = ("application/json",)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 5
+TRANSACT_MAX_RETRIES = 5
+# Cancellation reasons that do not depend on the data and are worth retrying
+TRANSACT_RETRYABLE_CODES = {
+    "TransactionConflict",
+    "ThrottlingError",
+    "ProvisionedThroughputExceeded",
+}
 
-def envelop(content, statusCode=200):
+
+# Pass the request event to answer conditional requests and compress the body
+def envelop(content, statusCode=200, event=None):
     if statusCode == 200:
-        body = json.dumps(content, default=int)
+        body = encode_json(content)
     else:
-        body = json.dumps({"errors": {"body": [content]}})
+        body = encode_json({"errors": {"body": [content]}})
         logging.error(body)
 
     response = {
@@ -20,4 +129,284 @@ def envelop(content, statusCode=200):
         },
         "body": body,
     }
+    if event is not None and statusCode == 200:
+        return negotiate(response, event)
+    return response
+
+
+# The ETag is strong: it covers the body and the content coding it is sent in
+def negotiate(response, event):
+    body = response["body"].encode()
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    encoding = None
+    if len(body) >= COMPRESSION_MIN_BYTES and accepts_binary(
+        request_header(event, "accept")
+    ):
+        encoding = choose_encoding(request_header(event, "accept-encoding"))
+
+    headers = response["headers"]
+    headers["Vary"] = "Accept-Encoding"
+    headers["ETag"] = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+    if etag_matches(request_header(event, "if-none-match"), digest):
+        response["statusCode"] = 304
+        response["body"] = ""
+    elif encoding:
+        headers["Content-Encoding"] = encoding
+        response["body"] = base64.b64encode(COMPRESSORS[encoding](body)).decode()
+        response["isBase64Encoded"] = True
     return response
+
+
+COMPRESSORS = {
+    "br": lambda body: brotli.compress(body, quality=BROTLI_QUALITY),
+    "gzip": lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0),
+}
+
+
+def choose_encoding(accept_encoding):
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, *params = part.split(";")
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+# API Gateway only decodes a base64 body when the first Accept type is binary;
+# other clients would receive the base64 text
+def accepts_binary(accept):
+    media_type = (accept or "").split(",")[0].split(";")[0].strip().lower()
+    return media_type in BINARY_MEDIA_TYPES
+
+
+# Any variant of the body matches, whatever coding the client cached it in
+def etag_matches(if_none_match, digest):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"').split("-")[0] == digest:
+            return True
+    return False
+
+
+def request_header(event, name):
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+# Request bodies arrive base64 encoded when API Gateway treats them as binary
+def parse_body(event):
+    body = event["body"]
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    return json.loads(body)
+
+
+# Numbers read through the resource layer arrive as Decimal
+def json_number(value):
+    if isinstance(value, Decimal):
+        integer = int(value)
+        return integer if integer == value else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+json_encoder = json.JSONEncoder(default=json_number)
+
+
+def encode_json(content):
+    if orjson is not None and JSON_ENCODER != "json":
+        return orjson.dumps(content, default=json_number).decode()
+    return json_encoder.encode(content)
+
+
+# ProjectionExpression parameters for the given attributes. Names are always
+# aliased so reserved words need no special care.
+def projection(attributes):
+    names = {f"#p{index}": attribute for index, attribute in enumerate(attributes)}
+    return {
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+
+# Sort key of the per-article entries of the feed, tag and favorites tables:
+# the creation time, then the slug to keep keys unique
+def article_entry_key(article):
+    return f"{int(article['createdAt']):012d}#{article['slug']}"
+
+
+# Newest first entries of one partition after start_key, reading only
+# offset + limit entries. Returns the entries and the key to continue from.
+def query_newest_first(table, keyCondition, limit, offset, start_key=None):
+    queryParams = {"KeyConditionExpression": keyCondition, "ScanIndexForward": False}
+    entries, last_key = query_page(table, queryParams, offset + limit, start_key)
+    return entries[offset:], last_key
+
+
+# Read up to limit items of a query, from start_key on. Returns the items and
+# the key to continue from, None once the query is exhausted.
+def query_page(table, queryParams, limit, start_key=None):
+    queryParams = dict(queryParams)
+    items = []
+    last_key = start_key
+    while len(items) < limit:
+        if last_key is not None:
+            queryParams["ExclusiveStartKey"] = last_key
+        queryParams["Limit"] = limit - len(items)
+        queryResult = table.query(**queryParams)
+        items.extend(queryResult["Items"])
+        last_key = queryResult.get("LastEvaluatedKey")
+        if last_key is None:
+            break
+    return items, last_key
+
+
+# limit and offset query string parameters, which arrive as strings. The
+# limit is kept within 1..PAGE_MAX_LIMIT so every page makes progress.
+def page_params(params, default_limit=20):
+    try:
+        limit = int(params.get("limit", default_limit))
+    except (TypeError, ValueError):
+        limit = default_limit
+    limit = min(max(1, limit), PAGE_MAX_LIMIT)
+    try:
+        offset = max(0, int(params.get("offset", 0)))
+    except (TypeError, ValueError):
+        offset = 0
+    return limit, offset
+
+
+# Run writes in one transaction. Returns None on success, or the index of the
+# write whose condition failed. Transactions cancelled by a conflicting
+# transaction or by throttling are retried with exponential backoff; any
+# other cancellation is raised.
+def transact_conditional_writes(client, writes):
+    retries = 0
+    while True:
+        try:
+            client.transact_write_items(TransactItems=writes)
+            return None
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get("CancellationReasons", [])
+            codes = [reason.get("Code") for reason in reasons]
+            if "ConditionalCheckFailed" in codes:
+                return codes.index("ConditionalCheckFailed")
+            retryable = TRANSACT_RETRYABLE_CODES.intersection(codes)
+            if not retryable or retries >= TRANSACT_MAX_RETRIES:
+                raise
+            time.sleep(0.05 * 2**retries)
+            retries += 1
+
+
+# Fetch keys from one table with BatchGetItem. Keys are deduplicated, sent in
+# chunks of 100 and UnprocessedKeys are retried with exponential backoff.
+def batch_get_items(dynamodb, table_name, keys, **request_params):
+    unique_keys = list({tuple(sorted(key.items())): key for key in keys}.values())
+    items = []
+    for start in range(0, len(unique_keys), BATCH_GET_MAX_KEYS):
+        request_items = {
+            table_name: dict(
+                request_params, Keys=unique_keys[start : start + BATCH_GET_MAX_KEYS]
+            )
+        }
+        retries = 0
+        while request_items:
+            result = dynamodb.batch_get_item(RequestItems=request_items)
+            items.extend(result.get("Responses", {}).get(table_name, []))
+            request_items = result.get("UnprocessedKeys")
+            if request_items:
+                if retries >= BATCH_GET_MAX_RETRIES:
+                    raise RuntimeError(f"Unprocessed keys remain for {table_name}")
+                time.sleep(0.05 * 2**retries)
+                retries += 1
+    return items
+
+
+# Scan a table with one thread per segment. Pages are handed back to the
+# calling thread as they arrive, so the caller can merge them while the other
+# segments are still being read. Expressions must be strings.
+def parallel_scan(table, total_segments, **scanParams):
+    pages = queue.Queue()
+
+    def scan_segment(segment):
+        params = dict(scanParams, Segment=segment, TotalSegments=total_segments)
+        try:
+            while True:
+                scanResult = table.scan(**params)
+                pages.put(scanResult["Items"])
+                if "LastEvaluatedKey" not in scanResult:
+                    break
+                params["ExclusiveStartKey"] = scanResult["LastEvaluatedKey"]
+        finally:
+            pages.put(None)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        futures = [executor.submit(scan_segment, s) for s in range(total_segments)]
+        finished = 0
+        while finished < total_segments:
+            page = pages.get()
+            if page is None:
+                finished += 1
+            else:
+                yield from page
+        for future in futures:
+            future.result()
+
+
+# Per-container LRU cache whose entries expire after a time to live. Hit and
+# miss counts are kept for metrics.
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
@@ -5,7 +5,15 @@ import pytest
 import sys, os
 
 sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
-from src import user, article
+from src import user, article, throttle
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    article.tags_cache.invalidate()
+    user.token_cache.invalidate()
+    user.email_cache.invalidate()
+    throttle.failure_cache.invalidate()
 
 
 @pytest.fixture
@@ -25,7 +33,64 @@ def dynamodb_client(aws_credentials):
 
 
 @pytest.fixture
-def users_table(dynamodb_client):
+def follows_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-follows",
+        KeySchema=[
+            {"AttributeName": "follower", "KeyType": "HASH"},
+            {"AttributeName": "followee", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "follower", "AttributeType": "S"},
+            {"AttributeName": "followee", "AttributeType": "S"},
+        ],
+        ProvisionedThroughput={"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "followee",
+                "KeySchema": [
+                    {"AttributeName": "followee", "KeyType": "HASH"},
+                    {"AttributeName": "follower", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+                "ProvisionedThroughput": {
+                    "ReadCapacityUnits": 1,
+                    "WriteCapacityUnits": 1,
+                },
+            }
+        ],
+    )
+    yield table
+
+
+@pytest.fixture
+def login_throttle_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-login-throttle",
+        KeySchema=[{"AttributeName": "throttleKey", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "throttleKey", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    yield table
+
+
+@pytest.fixture
+def emails_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-emails",
+        KeySchema=[{"AttributeName": "email", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "email", "AttributeType": "S"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    yield table
+
+
+@pytest.fixture
+def users_table(dynamodb_client, follows_table, login_throttle_table, emails_table):
     table = dynamodb_client.create_table(
         TableName="dev-users",
         KeySchema=[{"AttributeName": "username", "KeyType": "HASH"}],
@@ -50,7 +115,92 @@ def users_table(dynamodb_client):
 
 
 @pytest.fixture
-def articles_table(dynamodb_client):
+def feeds_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-feeds",
+        KeySchema=[
+            {"AttributeName": "username", "KeyType": "HASH"},
+            {"AttributeName": "feedKey", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "username", "AttributeType": "S"},
+            {"AttributeName": "feedKey", "AttributeType": "S"},
+        ],
+        ProvisionedThroughput={"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
+    )
+    yield table
+
+
+@pytest.fixture
+def article_tags_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-article-tags",
+        KeySchema=[
+            {"AttributeName": "tag", "KeyType": "HASH"},
+            {"AttributeName": "indexKey", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "tag", "AttributeType": "S"},
+            {"AttributeName": "indexKey", "AttributeType": "S"},
+        ],
+        ProvisionedThroughput={"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
+    )
+    yield table
+
+
+@pytest.fixture
+def tags_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-tags",
+        KeySchema=[
+            {"AttributeName": "dummy", "KeyType": "HASH"},
+            {"AttributeName": "tag", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "dummy", "AttributeType": "S"},
+            {"AttributeName": "tag", "AttributeType": "S"},
+        ],
+        ProvisionedThroughput={"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
+    )
+    yield table
+
+
+@pytest.fixture
+def favorites_table(dynamodb_client):
+    table = dynamodb_client.create_table(
+        TableName="dev-favorites",
+        KeySchema=[
+            {"AttributeName": "username", "KeyType": "HASH"},
+            {"AttributeName": "indexKey", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "username", "AttributeType": "S"},
+            {"AttributeName": "indexKey", "AttributeType": "S"},
+            {"AttributeName": "slug", "AttributeType": "S"},
+        ],
+        ProvisionedThroughput={"ReadCapacityUnits": 1, "WriteCapacityUnits": 1},
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "article",
+                "KeySchema": [
+                    {"AttributeName": "slug", "KeyType": "HASH"},
+                    {"AttributeName": "username", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "KEYS_ONLY"},
+                "ProvisionedThroughput": {
+                    "ReadCapacityUnits": 1,
+                    "WriteCapacityUnits": 1,
+                },
+            }
+        ],
+    )
+    yield table
+
+
+@pytest.fixture
+def articles_table(
+    dynamodb_client, feeds_table, article_tags_table, tags_table, favorites_table
+):
     attribute_definitions = [
         {"AttributeName": "slug", "AttributeType": "S"},
         {"AttributeName": "dummy", "AttributeType": "S"},
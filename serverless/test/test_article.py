@@ -206,3 +206,486 @@ def test_get_tags(articles_table, article1, article2, article3, user1Token, user
     ret = article.get_tags({}, {})
     assert ret["statusCode"] == 200
     assert set(ret["body"]["tags"]) == {"tag2", "tag1"}
+
+
+def test_get_feed_fan_out(articles_table, article1, article2, user1Token, user2Token):
+    headers = {"Authorization": f"Token {user1Token}"}
+    headers2 = {"Authorization": f"Token {user2Token}"}
+    event = {
+        "headers": headers2,
+        "pathParameters": {"username": "john doe"},
+        "httpMethod": "POST",
+    }
+    user.follow(event, {})
+
+    # articles created after the follow are written to the follower's feed
+    event = {"headers": headers, "body": {"article": article1}}
+    slug1 = article.create_article(event, {})["body"]["article"]["slug"]
+    event = {"headers": headers, "body": {"article": article2}}
+    article.create_article(event, {})
+
+    ret = article.get_feed({"headers": headers2}, {})
+    assert ret["statusCode"] == 200
+    assert {a["title"] for a in ret["body"]["articles"]} == {"title1", "title2"}
+
+    event = {"headers": headers, "pathParameters": {"slug": slug1}}
+    article.delete_article(event, {})
+    ret = article.get_feed({"headers": headers2}, {})
+    assert [a["title"] for a in ret["body"]["articles"]] == ["title2"]
+
+    event = {
+        "headers": headers2,
+        "pathParameters": {"username": "john doe"},
+        "httpMethod": "DELETE",
+    }
+    user.follow(event, {})
+    ret = article.get_feed({"headers": headers2}, {})
+    assert ret["body"]["articles"] == []
+
+
+def test_get_feed_merge(
+    monkeypatch, articles_table, article1, article2, article3, user1Token, user2Token
+):
+    monkeypatch.setattr(article, "FEED_STRATEGY", "merge")
+    monkeypatch.setattr(user, "FEED_STRATEGY", "merge")
+    monkeypatch.setattr(article, "FEED_MERGE_PAGE_SIZE", 1)
+    headers = {"Authorization": f"Token {user1Token}"}
+    headers2 = {"Authorization": f"Token {user2Token}"}
+    for article_val in [article1, article2]:
+        event = {"headers": headers, "body": {"article": article_val}}
+        article.create_article(event, {})
+    event = {"headers": headers2, "body": {"article": article3}}
+    article.create_article(event, {})
+
+    event = {
+        "headers": headers2,
+        "pathParameters": {"username": "john doe"},
+        "httpMethod": "POST",
+    }
+    user.follow(event, {})
+
+    event = {"headers": headers2, "queryStringParameters": {"limit": 1}}
+    ret = article.get_feed(event, {})
+    assert ret["statusCode"] == 200
+    assert len(ret["body"]["articles"]) == 1
+    assert ret["body"]["articles"][0]["author"]["username"] == "john doe"
+
+    ret = article.get_feed({"headers": headers2}, {})
+    assert {a["title"] for a in ret["body"]["articles"]} == {"title1", "title2"}
+
+    # The merge strategy needs no feed rows
+    assert article.feed.feeds_table.scan()["Items"] == []
+
+
+def test_list_articles_sharded(
+    monkeypatch, articles_table, article1, article2, article3, user1Token
+):
+    monkeypatch.setattr(article, "TIMELINE_SHARDS", 3)
+    headers = {"Authorization": f"Token {user1Token}"}
+    for article_val in [article1, article2, article3]:
+        event = {"headers": headers, "body": {"article": article_val}}
+        article.create_article(event, {})
+    # articles written before sharding live on the original partition key
+    articles_table.put_item(
+        Item={
+            "slug": "legacy",
+            "title": "legacy",
+            "description": "legacy",
+            "body": "legacy",
+            "createdAt": 1,
+            "updatedAt": 1,
+            "author": "john doe",
+            "dummy": "partition",
+            "favoritesCount": 0,
+        }
+    )
+
+    ret = article.list_articles({"headers": headers}, {})
+    assert ret["statusCode"] == 200
+    titles = [a["title"] for a in ret["body"]["articles"]]
+    assert set(titles) == {"title1", "title2", "title3", "legacy"}
+    assert titles[-1] == "legacy"
+
+    event = {"headers": headers, "queryStringParameters": {"limit": 2, "offset": 3}}
+    ret = article.list_articles(event, {})
+    assert [a["title"] for a in ret["body"]["articles"]] == ["legacy"]
+
+    # Writing to fewer shards keeps the higher shards listed
+    monkeypatch.setattr(article, "TIMELINE_SHARDS", 1)
+    ret = article.list_articles({"headers": headers}, {})
+    assert len(ret["body"]["articles"]) == 4
+
+
+def test_list_articles_by_tag_and_favorited(
+    articles_table, article1, article3, user1Token, user2Token
+):
+    headers = {"Authorization": f"Token {user1Token}"}
+    headers2 = {"Authorization": f"Token {user2Token}"}
+    event = {"headers": headers, "body": {"article": article1}}
+    slug1 = article.create_article(event, {})["body"]["article"]["slug"]
+    event = {"headers": headers, "body": {"article": article3}}
+    slug3 = article.create_article(event, {})["body"]["article"]["slug"]
+
+    event = {"headers": headers, "queryStringParameters": {"tag": "tag1"}}
+    ret = article.list_articles(event, {})
+    assert [a["slug"] for a in ret["body"]["articles"]] == [slug3]
+
+    event = {
+        "headers": headers,
+        "pathParameters": {"slug": slug3},
+        "body": {"article": {"body": "changed", "tagList": ["tag2", "tag3"]}},
+    }
+    article.update_article(event, {})
+    event = {"headers": headers, "queryStringParameters": {"tag": "tag1"}}
+    assert article.list_articles(event, {})["body"]["articles"] == []
+    event = {"headers": headers, "queryStringParameters": {"tag": "tag3"}}
+    ret = article.list_articles(event, {})
+    assert [a["slug"] for a in ret["body"]["articles"]] == [slug3]
+
+    event = {
+        "httpMethod": "POST",
+        "headers": headers2,
+        "pathParameters": {"slug": slug1},
+    }
+    article.favorite_article(event, {})
+    event = {"headers": headers, "queryStringParameters": {"favorited": "jane doe"}}
+    ret = article.list_articles(event, {})
+    assert [a["slug"] for a in ret["body"]["articles"]] == [slug1]
+
+    event = {"headers": headers, "pathParameters": {"slug": slug1}}
+    article.delete_article(event, {})
+    event = {"headers": headers, "queryStringParameters": {"favorited": "jane doe"}}
+    assert article.list_articles(event, {})["body"]["articles"] == []
+
+
+def test_plan_article_query():
+    assert article.plan_article_query({"tag": "t"})["path"] == "tag-index"
+    assert article.plan_article_query({"favorited": "u"})["path"] == "favorites-index"
+    assert article.plan_article_query({"author": "u"})["path"] == "author-index"
+    assert article.plan_article_query({"limit": 5})["path"] == "timeline"
+
+
+def test_get_tags_counts(articles_table, article1, article3, user1Token):
+    headers = {"Authorization": f"Token {user1Token}"}
+    article3_2 = dict(article3, tagList=["tag2"])
+    event = {"headers": headers, "body": {"article": article3}}
+    slug = article.create_article(event, {})["body"]["article"]["slug"]
+    event = {"headers": headers, "body": {"article": article3_2}}
+    article.create_article(event, {})
+
+    ret = article.get_tags({}, {})
+    assert ret["body"]["tags"] == ["tag2", "tag1"]
+
+    event = {"headers": headers, "pathParameters": {"slug": slug}}
+    article.delete_article(event, {})
+    ret = article.get_tags({}, {})
+    assert ret["body"]["tags"] == ["tag2"]
+
+
+def test_get_tags_cache(articles_table, article1, article3, user1Token):
+    headers = {"Authorization": f"Token {user1Token}"}
+    event = {"headers": headers, "body": {"article": article3}}
+    slug = article.create_article(event, {})["body"]["article"]["slug"]
+
+    before = article.get_tags_cache_stats()
+    assert set(article.get_tags({}, {})["body"]["tags"]) == {"tag1", "tag2"}
+    assert set(article.get_tags({}, {})["body"]["tags"]) == {"tag1", "tag2"}
+    after = article.get_tags_cache_stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    # writes from this container invalidate the cached tags
+    event = {"headers": headers, "pathParameters": {"slug": slug}}
+    article.delete_article(event, {})
+    assert article.get_tags({}, {})["body"]["tags"] == []
+
+
+def test_rebuild_tags(articles_table, user1Token):
+    for index, tags in enumerate([["tag1", "tag2"], ["tag2"], []]):
+        articles_table.put_item(
+            Item={
+                "slug": f"legacy-{index}",
+                "title": "legacy",
+                "description": "legacy",
+                "body": "legacy",
+                "createdAt": index,
+                "updatedAt": index,
+                "author": "john doe",
+                "dummy": "partition",
+                "favoritesCount": 0,
+                "tagList": tags,
+            }
+        )
+
+    ret = article.rebuild_tags({}, {})
+    assert ret["statusCode"] == 200
+    assert article.get_tags({}, {})["body"]["tags"] == ["tag2", "tag1"]
+
+    event = {"queryStringParameters": {"tag": "tag1"}}
+    ret = article.list_articles(event, {})
+    assert [a["slug"] for a in ret["body"]["articles"]] == ["legacy-0"]
+
+
+def test_favorite_article_idempotent(articles_table, article1, user1Token, user2Token):
+    headers = {"Authorization": f"Token {user1Token}"}
+    headers2 = {"Authorization": f"Token {user2Token}"}
+    event = {"headers": headers, "body": {"article": article1}}
+    slug = article.create_article(event, {})["body"]["article"]["slug"]
+
+    for headers_val in [headers, headers2, headers2]:
+        event = {
+            "httpMethod": "POST",
+            "headers": headers_val,
+            "pathParameters": {"slug": slug},
+        }
+        ret = article.favorite_article(event, {})
+        assert ret["body"]["article"]["favorited"] == True
+    assert ret["body"]["article"]["favoritesCount"] == 2
+
+    event = {
+        "httpMethod": "DELETE",
+        "headers": headers,
+        "pathParameters": {"slug": slug},
+    }
+    article.favorite_article(event, {})
+    ret = article.favorite_article(event, {})
+    assert ret["body"]["article"]["favorited"] == False
+    assert ret["body"]["article"]["favoritesCount"] == 1
+
+    ret = article.list_articles({"headers": headers2}, {})
+    assert ret["body"]["articles"][0]["favorited"] == True
+    assert ret["body"]["articles"][0]["favoritesCount"] == 1
+    ret = article.list_articles({"headers": headers}, {})
+    assert ret["body"]["articles"][0]["favorited"] == False
+
+
+def put_articles(articles_table, count, author="john doe"):
+    slugs = []
+    for index in range(count):
+        slug = f"article-{author}-{index}"
+        articles_table.put_item(
+            Item={
+                "slug": slug,
+                "title": slug,
+                "description": slug,
+                "body": slug,
+                "createdAt": 1000 + index,
+                "updatedAt": 1000 + index,
+                "author": author,
+                "dummy": article.timeline_shard(index % article.TIMELINE_SHARDS),
+                "favoritesCount": 0,
+                "tagList": ["paged"],
+            }
+        )
+        slugs.append(slug)
+    return slugs[::-1]
+
+
+def walk_pages(handler, event, limit):
+    slugs = []
+    params = {"limit": str(limit)}
+    while True:
+        ret = handler(
+            dict(event, queryStringParameters=dict(event["params"], **params)), {}
+        )
+        assert ret["statusCode"] == 200
+        assert len(ret["body"]["articles"]) <= limit
+        slugs.extend(a["slug"] for a in ret["body"]["articles"])
+        if ret["body"]["nextCursor"] is None:
+            return slugs
+        params["cursor"] = ret["body"]["nextCursor"]
+
+
+@pytest.mark.parametrize("filters", [{}, {"author": "john doe"}, {"tag": "paged"}])
+def test_list_articles_cursor(monkeypatch, articles_table, user1Token, filters):
+    monkeypatch.setattr(article, "TIMELINE_SHARDS", 3)
+    newest_first = put_articles(articles_table, 7)
+    if "tag" in filters:
+        from src import article_index
+
+        for index, slug in enumerate(newest_first[::-1]):
+            article_index.add_tags({"slug": slug, "createdAt": 1000 + index}, ["paged"])
+
+    event = {"headers": {"Authorization": f"Token {user1Token}"}, "params": filters}
+    assert walk_pages(article.list_articles, event, 3) == newest_first
+
+
+def test_list_articles_invalid_cursor(articles_table, user1Token):
+    put_articles(articles_table, 3)
+    headers = {"Authorization": f"Token {user1Token}"}
+    ret = article.list_articles(
+        {"headers": headers, "queryStringParameters": {"limit": 1}}, {}
+    )
+    cursor = ret["body"]["nextCursor"]
+
+    # Cursors are bound to their listing and cannot be edited
+    for params in [{"cursor": cursor, "author": "john doe"}, {"cursor": cursor[:-2]}]:
+        ret = article.list_articles(
+            {"headers": headers, "queryStringParameters": params}, {}
+        )
+        assert ret["statusCode"] == 422
+
+
+@pytest.mark.parametrize("strategy", ["table", "merge"])
+def test_get_feed_cursor(monkeypatch, strategy, articles_table, user1Token, user2Token):
+    from src import feed
+
+    monkeypatch.setattr(article, "FEED_STRATEGY", strategy)
+    newest_first = sorted(
+        put_articles(articles_table, 4) + put_articles(articles_table, 3, "someone"),
+        key=lambda slug: -int(slug.rsplit("-", 1)[1]),
+    )
+    for author in ["john doe", "someone"]:
+        user.follows_table.put_item(Item={"follower": "jane doe", "followee": author})
+        feed.add_author("jane doe", author)
+
+    event = {"headers": {"Authorization": f"Token {user2Token}"}, "params": {}}
+    slugs = walk_pages(article.get_feed, event, 2)
+    assert sorted(slugs) == sorted(newest_first)
+    created = [int(slug.rsplit("-", 1)[1]) for slug in slugs]
+    assert created == sorted(created, reverse=True)
+
+
+def test_feed_backfill_and_remove_author(monkeypatch, articles_table, user1Token):
+    from src import feed
+
+    monkeypatch.setattr(feed, "FEED_BACKFILL_LIMIT", 2)
+    newest_first = put_articles(articles_table, 3)
+    other = put_articles(articles_table, 1, "someone")
+    feed.add_author("jane doe", "someone")
+    feed.add_author("jane doe", "john doe")
+
+    entries, _ = feed.query_feed("jane doe", 10, 0)
+    assert [e["slug"] for e in entries] == newest_first[:2] + other
+
+    feed.remove_author("jane doe", "john doe")
+    entries, _ = feed.query_feed("jane doe", 10, 0)
+    assert [e["slug"] for e in entries] == other
+
+
+def test_update_article_tags_only(articles_table, article1, user1Token):
+    headers = {"Authorization": f"Token {user1Token}"}
+    event = {"headers": headers, "body": {"article": article1}}
+    slug = article.create_article(event, {})["body"]["article"]["slug"]
+
+    event = {
+        "headers": headers,
+        "pathParameters": {"slug": slug},
+        "body": {"article": {"tagList": ["tag9"]}},
+    }
+    ret = article.update_article(event, {})
+    assert ret["statusCode"] == 200
+    assert ret["body"]["article"]["tagList"] == ["tag9"]
+
+    event["body"] = {"article": {"tagList": "abc"}}
+    ret = article.update_article(event, {})
+    assert ret["statusCode"] == 422
+    assert article.get_tags({}, {})["body"]["tags"] == ["tag9"]
+
+
+def test_favorite_article_conflict_retried(
+    monkeypatch, articles_table, article1, user1Token
+):
+    from src import article_index, util
+
+    headers = {"Authorization": f"Token {user1Token}"}
+    event = {"headers": headers, "body": {"article": article1}}
+    slug = article.create_article(event, {})["body"]["article"]["slug"]
+
+    # A conflicting transaction cancels the first attempt
+    client = article_index.dynamodb.meta.client
+    transact_write_items = client.transact_write_items
+    conflict = client.exceptions.TransactionCanceledException(
+        {
+            "Error": {"Code": "TransactionCanceledException"},
+            "CancellationReasons": [{"Code": "TransactionConflict"}, {"Code": "None"}],
+        },
+        "TransactWriteItems",
+    )
+    attempts = []
+
+    def flaky(**params):
+        attempts.append(params)
+        if len(attempts) == 1:
+            raise conflict
+        return transact_write_items(**params)
+
+    monkeypatch.setattr(client, "transact_write_items", flaky)
+    monkeypatch.setattr(util.time, "sleep", lambda seconds: None)
+    event = {"httpMethod": "POST", "headers": headers, "pathParameters": {"slug": slug}}
+    ret = article.favorite_article(event, {})
+    assert len(attempts) == 2
+    assert ret["body"]["article"]["favoritesCount"] == 1
+
+
+def test_update_deleted_article(monkeypatch, articles_table, article1, user1Token):
+    headers = {"Authorization": f"Token {user1Token}"}
+    event = {"headers": headers, "body": {"article": article1}}
+    slug = article.create_article(event, {})["body"]["article"]["slug"]
+
+    # The article is deleted between the read and the update
+    get_item = article.articles_table.get_item
+
+    def get_then_delete(**params):
+        result = get_item(**params)
+        article.articles_table.delete_item(Key={"slug": slug})
+        return result
+
+    monkeypatch.setattr(article.articles_table, "get_item", get_then_delete)
+    event = {
+        "headers": headers,
+        "pathParameters": {"slug": slug},
+        "body": {"article": {"body": "changed"}},
+    }
+    ret = article.update_article(event, {})
+    assert ret["statusCode"] == 422
+    monkeypatch.undo()
+    assert article.get_article_by_slug(slug) is None
+
+
+def test_list_articles_limit_bounds(articles_table, user1Token):
+    event = {"headers": {"Authorization": f"Token {user1Token}"}, "params": {}}
+    ret = article.list_articles(dict(event, queryStringParameters={}), {})
+    assert ret["body"]["articles"] == []
+    assert ret["body"]["nextCursor"] is None
+
+    # limit=0 is read as limit=1, so walking the pages still ends
+    newest_first = put_articles(articles_table, 3)
+    slugs, params = [], {"limit": "0"}
+    while params.get("cursor", "") is not None:
+        ret = article.list_articles(dict(event, queryStringParameters=params), {})
+        slugs.extend(a["slug"] for a in ret["body"]["articles"])
+        params["cursor"] = ret["body"]["nextCursor"]
+    assert slugs == newest_first
+    assert article.query_timeline(0, 0) == ([], None)
+    assert article.merge_feed(["john doe"], 0, 0) == ([], None)
+
+
+def test_migrate_favorites(articles_table, user1Token, user2Token):
+    (slug,) = put_articles(articles_table, 1)
+    articles_table.update_item(
+        Key={"slug": slug},
+        UpdateExpression="SET favoritesCount = :count, favoritedBy = :users",
+        ExpressionAttributeValues={":count": 5, ":users": ["jane doe", "someone"]},
+    )
+
+    ret = article.migrate_favorites({}, {})
+    assert ret["body"] == {"articles": 1}
+    headers = {"Authorization": f"Token {user2Token}"}
+    event = {"headers": headers, "pathParameters": {"slug": slug}}
+    ret = article.get_article(event, {})
+    assert ret["body"]["article"]["favorited"] == True
+    assert ret["body"]["article"]["favoritesCount"] == 2
+
+    event = {"queryStringParameters": {"favorited": "someone"}}
+    ret = article.list_articles(event, {})
+    assert [a["slug"] for a in ret["body"]["articles"]] == [slug]
+
+    event = {
+        "httpMethod": "DELETE",
+        "headers": headers,
+        "pathParameters": {"slug": slug},
+    }
+    ret = article.favorite_article(event, {})
+    assert ret["body"]["article"]["favorited"] == False
+    assert ret["body"]["article"]["favoritesCount"] == 1
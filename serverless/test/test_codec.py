@@ -0,0 +1,66 @@
+import sys, os
+from decimal import Decimal
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+from src import codec
+
+article = {
+    "slug": "how-to-train-your-dragon-1a2b3c4d",
+    "title": "How to train your dragon",
+    "description": "Ever wonder how?",
+    "body": "Very carefully.",
+    "author": "john doe",
+    "dummy": "partition",
+    "createdAt": 1700000000,
+    "updatedAt": 1700000100,
+    "favoritesCount": 2,
+    "tagList": ["dragons", "training"],
+}
+
+
+def test_matches_resource_layer():
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    values = dict(
+        article,
+        rating=Decimal("4.5"),
+        extra={"nested": [1, "two", None, True]},
+        tags={"a", "b"},
+        blob=b"\x00\x01",
+    )
+    encoded = codec.encode_item(values)
+    assert encoded == {name: serializer.serialize(v) for name, v in values.items()}
+    decoded = codec.decode_item(encoded, codec.ARTICLE)
+    assert decoded == {name: deserializer.deserialize(v) for name, v in encoded.items()}
+    assert type(decoded["createdAt"]) is int
+    assert type(decoded["rating"]) is Decimal
+
+
+def test_unexpected_field_type():
+    encoded = codec.encode_item(dict(article, tagList=[1, 2]))
+    assert codec.decode_item(encoded, codec.ARTICLE)["tagList"] == [1, 2]
+
+
+def test_encode_request_conditions():
+    from boto3.dynamodb.conditions import Key, Attr
+
+    request = codec.encode_request(
+        {
+            "KeyConditionExpression": Key("author").eq("john doe"),
+            "FilterExpression": Attr("favoritesCount").gt(1),
+            "ExpressionAttributeNames": {"#p0": "slug"},
+            "ProjectionExpression": "#p0",
+        }
+    )
+    assert request["KeyConditionExpression"] == "#n0 = :v0"
+    assert request["FilterExpression"] == "#n1 > :v1"
+    assert request["ExpressionAttributeNames"] == {
+        "#p0": "slug",
+        "#n0": "author",
+        "#n1": "favoritesCount",
+    }
+    assert request["ExpressionAttributeValues"] == {
+        ":v0": {"S": "john doe"},
+        ":v1": {"N": "1"},
+    }
@@ -83,3 +83,31 @@ def test_delete_invalid_comment_id(article1Slug, comments_table, user2Token):
     ret = Comment.delete(event, {})
     assert ret["statusCode"] == 422
     assert ret["body"] == {"errors": {"body": ["Comment not found"]}}
+
+
+def test_get_paginated(article1Slug, comments_table, user2Token):
+    header = {"Authorization": f"Token {user2Token}"}
+    for index in range(5):
+        body = {"comment": {"body": f"comment{index}"}}
+        event = {
+            "headers": header,
+            "body": body,
+            "pathParameters": {"slug": article1Slug},
+        }
+        Comment.create(event, {})
+
+    bodies = []
+    params = {"limit": "2"}
+    while True:
+        event = {
+            "pathParameters": {"slug": article1Slug},
+            "queryStringParameters": params,
+        }
+        ret = Comment.get(event, {})
+        assert ret["statusCode"] == 200
+        assert len(ret["body"]["comments"]) <= 2
+        bodies.extend(comment["body"] for comment in ret["body"]["comments"])
+        if ret["body"]["nextCursor"] is None:
+            break
+        params = {"limit": "2", "cursor": ret["body"]["nextCursor"]}
+    assert sorted(bodies) == [f"comment{index}" for index in range(5)]
@@ -0,0 +1,35 @@
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from boto3.dynamodb.conditions import Key
+from src import db, user, article, feed
+
+
+def test_tables_are_shared():
+    assert db.table("articles") is article.articles_table
+    assert feed.articles_table is article.articles_table
+    assert user.users_table.name == "dev-users"
+
+
+def test_single_resource(users_table):
+    user.follows_table.meta
+    user.emails_table.meta
+    assert user.follows_table.meta.client is db.get_client()
+    assert user.emails_table.meta.client is db.get_client()
+
+
+def test_typed_table(users_table, user1Token):
+    found = user.users_table.get_item(Key={"username": "john doe"})["Item"]
+    assert type(found["password"]) is bytes
+
+    user.users_table.update_item(
+        Key={"username": "john doe"},
+        UpdateExpression="SET logins = :logins",
+        ExpressionAttributeValues={":logins": 3},
+    )
+    found = user.users_table.query(
+        KeyConditionExpression=Key("username").eq("john doe"),
+        ProjectionExpression="logins",
+    )["Items"]
+    assert found == [{"logins": 3}]
+    assert type(found[0]["logins"]) is int
@@ -0,0 +1,27 @@
+import sys, os
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from src import pagination
+
+listing = {"path": "timeline", "shards": 4}
+position = {"partition": {"slug": "a", "dummy": "partition", "createdAt": 1000}}
+
+
+def test_round_trip():
+    cursor = pagination.next_cursor(listing, position)
+    assert pagination.resume_cursor(cursor, listing) == position
+    assert pagination.next_cursor(listing, None) is None
+
+
+def test_rejects_other_listings_and_tampering(monkeypatch):
+    cursor = pagination.next_cursor(listing, position)
+    with pytest.raises(ValueError):
+        pagination.resume_cursor(cursor, {"path": "timeline", "shards": 8})
+
+    forged = pagination.encode_cursor({"listing": listing, "position": position})
+    monkeypatch.setattr(pagination, "CURSOR_SECRET_KEY", "another key")
+    for token in [forged, "not a cursor", cursor[:10]]:
+        with pytest.raises(ValueError):
+            pagination.resume_cursor(token, listing)
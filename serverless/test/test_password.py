@@ -0,0 +1,30 @@
+import pytest
+import sys, os
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from src import password
+
+
+@pytest.fixture(autouse=True)
+def fast_rounds(monkeypatch):
+    monkeypatch.setattr(password, "BCRYPT_ROUNDS", 4)
+
+
+def test_hash_and_check_password():
+    hashed = password.hash_password("password123")
+    assert password.hash_cost(hashed) == 4
+    assert password.check_password("password123", hashed)
+    assert not password.check_password("password321", hashed)
+
+
+def test_check_passwords():
+    hashed = password.hash_password("password123")
+    pairs = [("password123", hashed), ("wrong", hashed), ("password123", hashed)]
+    assert password.check_passwords(pairs) == [True, False, True]
+
+
+def test_needs_rehash(monkeypatch):
+    hashed = password.hash_password("password123")
+    assert not password.needs_rehash(hashed)
+    monkeypatch.setattr(password, "BCRYPT_ROUNDS", 5)
+    assert password.needs_rehash(hashed)
@@ -0,0 +1,77 @@
+import pytest
+import sys, os
+from datetime import datetime, timedelta
+
+import jwt
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from src import tokens
+
+KEY = "sample_secret_key"
+
+
+@pytest.fixture
+def verifier():
+    return tokens.TokenVerifier(KEY, "HS256")
+
+
+def decode_both(verifier, token):
+    results = []
+    for decode in [verifier.decode, lambda t: jwt.decode(t, KEY, ["HS256"])]:
+        try:
+            results.append(decode(token))
+        except Exception as e:
+            results.append((type(e), str(e)))
+    return results
+
+
+def test_decode_matches_jwt(verifier):
+    exp = datetime.utcnow() + timedelta(days=2)
+    token = jwt.encode({"username": "john doe", "exp": exp}, KEY, "HS256")
+    fast, generic = decode_both(verifier, token)
+    assert fast == generic
+    assert fast["username"] == "john doe"
+
+
+@pytest.mark.parametrize(
+    "payload,key,headers",
+    [
+        ({"username": "a", "exp": datetime.utcnow() - timedelta(seconds=1)}, KEY, None),
+        ({"username": "a"}, "other_key", None),
+        ({"username": "a", "nbf": datetime.utcnow() + timedelta(days=1)}, KEY, None),
+        ({"username": "a", "exp": "soon"}, KEY, None),
+        ({"username": "a"}, KEY, {"kid": "key-1"}),
+    ],
+)
+def test_decode_errors_match_jwt(verifier, payload, key, headers):
+    token = jwt.encode(payload, key, "HS256", headers=headers)
+    fast, generic = decode_both(verifier, token)
+    assert fast == generic
+
+
+@pytest.mark.parametrize("token", ["", "abc", "a.b", "a.b.c", "a.b.c.d"])
+def test_decode_malformed_matches_jwt(verifier, token):
+    fast, generic = decode_both(verifier, token)
+    assert fast == generic
+
+
+def test_decode_tampered(verifier):
+    token = jwt.encode({"username": "a"}, KEY, "HS256")
+    header, payload, signature = token.split(".")
+    forged = jwt.utils.base64url_encode(b'{"username":"b"}').decode()
+    fast, generic = decode_both(verifier, ".".join([header, forged, signature]))
+    assert fast == generic
+    assert fast[0] is jwt.InvalidSignatureError
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {"username": "john doe", "exp": datetime.utcnow() + timedelta(days=2)},
+        {"username": 'jöhn "doe"', "iat": datetime.utcnow(), "n": 1},
+        {},
+    ],
+)
+def test_encode_matches_jwt(payload):
+    signer = tokens.TokenSigner(KEY, "HS256")
+    assert signer.encode(payload) == jwt.encode(payload, KEY, "HS256")
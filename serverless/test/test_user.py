@@ -143,7 +143,7 @@ def test_get_profile_nonexisting(users_table, user1):
     assert ret["body"] == {"errors": {"body": ["User not found: nonexisting"]}}
 
 
-def test_follow_user(users_table, user1, user2):
+def test_follow_user(users_table, articles_table, user1, user2):
     eventbody = {"user": user1}
     event = {"body": eventbody}
     created1 = user.create_user(event, {})
@@ -170,3 +170,314 @@ def test_follow_user(users_table, user1, user2):
     profile = user.get_profile(event2, {})
     assert profile["statusCode"] == 200
     assert profile["body"]["profile"]["following"] == True
+
+
+def test_get_profiles_by_usernames(users_table, user1, user2):
+    user.create_user({"body": {"user": user1}}, {})
+    user.create_user({"body": {"user": user2}}, {})
+
+    profiles = user.get_profiles_by_usernames(
+        ["john doe", "kim doe", "john doe", "nonexisting"], None
+    )
+    assert set(profiles) == {"john doe", "kim doe"}
+    assert profiles["kim doe"]["username"] == "kim doe"
+    assert profiles["kim doe"]["following"] == False
+
+
+def test_unfollow_user(users_table, articles_table, user1, user2):
+    user.create_user({"body": {"user": user1}}, {})
+    created2 = user.create_user({"body": {"user": user2}}, {})
+    event = {
+        "headers": {"Authorization": "Bearer " + created2["body"]["user"]["token"]},
+        "httpMethod": "POST",
+        "pathParameters": {"username": "john doe"},
+    }
+    user.follow(event, {})
+    user.follow(event, {})
+    assert user.get_followers("john doe") == ["kim doe"]
+    assert user.get_followed_users("kim doe") == ["john doe"]
+    assert user.is_following("kim doe", "john doe")
+
+    event["httpMethod"] = "DELETE"
+    ret = user.follow(event, {})
+    assert ret["body"]["profile"]["following"] == False
+    assert user.get_followers("john doe") == []
+    assert not user.is_following("kim doe", "john doe")
+
+
+def test_get_user_by_username_projection(users_table, user1):
+    user.create_user({"body": {"user": user1}}, {})
+
+    assert user.get_user_by_username("john doe", user.USER_IDENTITY) == {
+        "username": "john doe"
+    }
+    account = user.get_user_by_username("john doe", user.USER_ACCOUNT)
+    assert account["email"] == "johndoe@gmail.com"
+    assert "password" not in account
+    assert "password" in user.get_user_by_username("john doe")
+
+
+def test_authenticate_from_claims(users_table, user1, monkeypatch):
+    created = user.create_user({"body": {"user": user1}}, {})
+    event = {"headers": {"Authorization": "Bearer " + created["body"]["user"]["token"]}}
+
+    reads = []
+    get_user_by_username = user.get_user_by_username
+    monkeypatch.setattr(
+        user,
+        "get_user_by_username",
+        lambda *args: reads.append(args) or get_user_by_username(*args),
+    )
+    authenticated_user = user.authenticate_and_get_user(
+        event, user.USER_IDENTITY, read_only=True
+    )
+    assert authenticated_user["username"] == "john doe"
+    assert reads == []
+
+    # attributes beyond the claims are loaded lazily, never the password
+    assert authenticated_user["email"] == "johndoe@gmail.com"
+    assert authenticated_user.get("bio", "") == ""
+    assert reads == [("john doe", user.USER_ACCOUNT)]
+    assert "password" not in authenticated_user
+
+    # handlers that write always read the user item
+    user.authenticate_and_get_user(event, user.USER_IDENTITY)
+    assert reads[-1] == ("john doe", user.USER_IDENTITY)
+
+
+def test_authenticate_deleted_user(users_table, user1, user2):
+    token = user.create_user({"body": {"user": user1}}, {})["body"]["user"]["token"]
+    user.create_user({"body": {"user": user2}}, {})
+    user.users_table.delete_item(Key={"username": "john doe"})
+    event = {
+        "headers": {"Authorization": "Bearer " + token},
+        "httpMethod": "POST",
+        "pathParameters": {"username": "kim doe"},
+    }
+
+    assert user.authenticate_and_get_user(event, user.USER_IDENTITY) is None
+    ret = user.follow(event, {})
+    assert ret["statusCode"] == 422
+    assert not user.is_following("john doe", "kim doe")
+
+
+def test_decode_token_cache(users_table, user1):
+    token = user.create_user({"body": {"user": user1}}, {})["body"]["user"]["token"]
+
+    before = user.get_token_cache_stats()
+    assert user.decode_token(token)["username"] == "john doe"
+    assert user.decode_token(token)["username"] == "john doe"
+    after = user.get_token_cache_stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    with pytest.raises(Exception):
+        user.decode_token(token + "invalid")
+
+
+def test_login_user_rehash(users_table, user1, monkeypatch):
+    from src import password
+
+    monkeypatch.setattr(password, "BCRYPT_ROUNDS", 4)
+    user.create_user({"body": {"user": user1}}, {})
+    monkeypatch.setattr(password, "BCRYPT_ROUNDS", 5)
+
+    eventbody = {"user": {"email": "johndoe@gmail.com", "password": "password123"}}
+    ret = user.login_user({"body": eventbody}, {})
+    assert ret["statusCode"] == 200
+    stored = user.get_user_by_username("john doe")["password"]
+    assert password.hash_cost(stored) == 5
+    ret = user.login_user({"body": eventbody}, {})
+    assert ret["statusCode"] == 200
+
+    # A user deleted while logging in is not recreated by the rehash
+    monkeypatch.setattr(password, "BCRYPT_ROUNDS", 6)
+    needs_rehash = password.needs_rehash
+
+    def delete_then_check(hashed):
+        user.users_table.delete_item(Key={"username": "john doe"})
+        return needs_rehash(hashed)
+
+    monkeypatch.setattr(password, "needs_rehash", delete_then_check)
+    ret = user.login_user({"body": eventbody}, {})
+    assert ret["statusCode"] == 200
+    assert user.get_user_by_username("john doe") is None
+
+
+def test_login_user_throttled(users_table, user1, monkeypatch):
+    from src import password, throttle
+
+    user.create_user({"body": {"user": user1}}, {})
+    checks = []
+    check_password = password.check_password
+    monkeypatch.setattr(
+        password,
+        "check_password",
+        lambda *args: checks.append(args) or check_password(*args),
+    )
+    identity = {"identity": {"sourceIp": "10.0.0.1"}}
+
+    # repeating the same wrong password is answered from the failure cache
+    eventbody = {"user": {"email": "johndoe@gmail.com", "password": "wrong"}}
+    event = {"body": eventbody, "requestContext": identity}
+    for _ in range(3):
+        ret = user.login_user(event, {})
+        assert ret["body"] == {"errors": {"body": ["Wrong password."]}}
+    assert len(checks) == 1
+
+    for attempt in range(throttle.LOGIN_MAX_FAILURES_PER_EMAIL):
+        eventbody = {"user": {"email": "johndoe@gmail.com", "password": f"{attempt}"}}
+        user.login_user({"body": eventbody, "requestContext": identity}, {})
+    checks.clear()
+    eventbody = {"user": {"email": "johndoe@gmail.com", "password": "password123"}}
+    ret = user.login_user({"body": eventbody, "requestContext": identity}, {})
+    assert ret["statusCode"] == 429
+    assert checks == []
+
+
+def test_login_user_failures_not_stale(users_table, user1):
+    from src import password
+
+    # A login before signing up is not remembered
+    eventbody = {"user": {"email": "johndoe@gmail.com", "password": "changed"}}
+    ret = user.login_user({"body": eventbody}, {})
+    assert ret["body"] == {"errors": {"body": ["Email not found: johndoe@gmail.com."]}}
+    user.create_user({"body": {"user": user1}}, {})
+    ret = user.login_user({"body": eventbody}, {})
+    assert ret["body"] == {"errors": {"body": ["Wrong password."]}}
+
+    # A password changed elsewhere is checked against its new hash
+    user.users_table.update_item(
+        Key={"username": "john doe"},
+        UpdateExpression="SET #password = :password",
+        ExpressionAttributeNames={"#password": "password"},
+        ExpressionAttributeValues={":password": password.hash_password("changed")},
+    )
+    ret = user.login_user({"body": eventbody}, {})
+    assert ret["statusCode"] == 200
+
+
+def test_create_user_duplicates(users_table, user1, user2):
+    user.create_user({"body": {"user": user1}}, {})
+
+    taken_username = dict(user2, username=user1["username"])
+    ret = user.create_user({"body": {"user": taken_username}}, {})
+    assert ret["statusCode"] == 422
+    assert ret["body"] == {"errors": {"body": ["Username already taken: john doe"]}}
+
+    taken_email = dict(user2, email=user1["email"])
+    ret = user.create_user({"body": {"user": taken_email}}, {})
+    assert ret["statusCode"] == 422
+    assert ret["body"] == {
+        "errors": {"body": ["Email already taken: johndoe@gmail.com"]}
+    }
+    assert user.get_user_by_username("kim doe") is None
+
+
+def test_update_user_email_claim(users_table, user1, user2):
+    created = user.create_user({"body": {"user": user1}}, {})
+    user.create_user({"body": {"user": user2}}, {})
+    headers = {"Authorization": "Bearer " + created["body"]["user"]["token"]}
+
+    taken = {"user": {"email": "kimdoe@gmail.com"}}
+    ret = user.update_user({"headers": headers, "body": taken}, {})
+    assert ret["statusCode"] == 422
+
+    # The old email is released once the new one is claimed
+    altered = {"user": {"email": "altered@gmail.com"}}
+    ret = user.update_user({"headers": headers, "body": altered}, {})
+    assert ret["statusCode"] == 200
+    ret = user.create_user(
+        {"body": {"user": dict(user2, username="jane doe", email="johndoe@gmail.com")}},
+        {},
+    )
+    assert ret["statusCode"] == 200
+
+
+def test_get_user_by_email(users_table, user1):
+    user.create_user({"body": {"user": user1}}, {})
+
+    found = user.get_user_by_email("johndoe@gmail.com", user.USER_IDENTITY)
+    assert found == {"username": "john doe", "email": "johndoe@gmail.com"}
+    assert user.email_cache.get("johndoe@gmail.com") == "john doe"
+    assert user.get_user_by_email("nobody@gmail.com") is None
+
+
+def test_get_user_by_email_unclaimed(users_table, emails_table):
+    # Users written before email claims existed
+    user.users_table.put_item(
+        Item={"username": "old doe", "email": "old@gmail.com", "password": b"x"}
+    )
+
+    found = user.get_user_by_email("old@gmail.com", user.USER_IDENTITY)
+    assert found["username"] == "old doe"
+    claim = user.emails_table.get_item(Key={"email": "old@gmail.com"})["Item"]
+    assert claim == {"email": "old@gmail.com", "username": "old doe"}
+
+
+def test_migrate_follows(users_table, articles_table, user1, user2, monkeypatch):
+    monkeypatch.setattr(user, "FEED_STRATEGY", "table")
+    user.create_user({"body": {"user": user1}}, {})
+    user.create_user({"body": {"user": user2}}, {})
+    # Follow lists as stored before the follows table, one edge on one side only
+    user.users_table.update_item(
+        Key={"username": "kim doe"},
+        UpdateExpression="SET following = :following",
+        ExpressionAttributeValues={":following": ["john doe"]},
+    )
+    user.users_table.update_item(
+        Key={"username": "john doe"},
+        UpdateExpression="SET followers = :followers, following = :following",
+        ExpressionAttributeValues={
+            ":followers": ["kim doe"],
+            ":following": ["jane doe"],
+        },
+    )
+    articles_table.put_item(
+        Item={
+            "slug": "legacy",
+            "author": "john doe",
+            "dummy": "partition",
+            "createdAt": 1,
+        }
+    )
+
+    ret = user.migrate_follows({}, {})
+    assert ret["statusCode"] == 200
+    assert ret["body"] == {"follows": 2}
+    assert user.is_following("kim doe", "john doe")
+    assert user.get_followed_users("john doe") == ["jane doe"]
+    assert user.get_followers("john doe") == ["kim doe"]
+    feed, _ = user.feed.query_feed("kim doe", 20, 0)
+    assert [entry["slug"] for entry in feed] == ["legacy"]
+
+
+def test_create_user_legacy_email(users_table, user1, user2):
+    # A user registered before email claims existed keeps their email
+    user.users_table.put_item(
+        Item={"username": "old doe", "email": "old@gmail.com", "password": b"x"}
+    )
+    ret = user.create_user({"body": {"user": dict(user1, email="old@gmail.com")}}, {})
+    assert ret["statusCode"] == 422
+    assert ret["body"] == {"errors": {"body": ["Email already taken: old@gmail.com"]}}
+
+    created = user.create_user({"body": {"user": user2}}, {})
+    headers = {"Authorization": "Bearer " + created["body"]["user"]["token"]}
+    taken = {"user": {"email": "old@gmail.com"}}
+    ret = user.update_user({"headers": headers, "body": taken}, {})
+    assert ret["statusCode"] == 422
+    claim = user.emails_table.get_item(Key={"email": "old@gmail.com"})["Item"]
+    assert claim["username"] == "old doe"
+
+
+def test_migrate_emails(users_table, user1):
+    user.create_user({"body": {"user": user1}}, {})
+    user.users_table.put_item(
+        Item={"username": "old doe", "email": "old@gmail.com", "password": b"x"}
+    )
+    user.users_table.put_item(Item={"username": "no email", "password": b"x"})
+
+    ret = user.migrate_emails({}, {})
+    assert ret["body"] == {"claimed": 1}
+    claim = user.emails_table.get_item(Key={"email": "old@gmail.com"})["Item"]
+    assert claim["username"] == "old doe"
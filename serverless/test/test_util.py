@@ -0,0 +1,100 @@
+import json
+import sys, os
+from decimal import Decimal
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+from src import util
+
+content = {
+    "articles": [
+        {
+            "slug": "how-to-train-your-dragon",
+            "title": "Ünïcode ☃",
+            "favoritesCount": Decimal("3"),
+            "rating": Decimal("4.5"),
+            "tagList": ["dragons"],
+            "favorited": False,
+            "image": None,
+        }
+    ],
+    "articlesCount": 1,
+}
+
+
+@pytest.mark.parametrize("encoder", ["auto", "json"])
+def test_encode_json(encoder, monkeypatch):
+    monkeypatch.setattr(util, "JSON_ENCODER", encoder)
+    decoded = json.loads(util.encode_json(content))
+    assert decoded["articles"][0]["favoritesCount"] == 3
+    assert decoded["articles"][0]["rating"] == 4.5
+    assert decoded["articles"][0]["title"] == "Ünïcode ☃"
+
+
+def test_encode_json_stdlib_compatible(monkeypatch):
+    monkeypatch.setattr(util, "JSON_ENCODER", "json")
+    ints = {"articles": [{"favoritesCount": 3}], "articlesCount": 1}
+    assert util.encode_json(ints) == json.dumps(ints, default=int)
+
+
+def test_encode_json_unsupported():
+    with pytest.raises(TypeError):
+        util.encode_json({"tags": {"a"}})
+
+
+def test_envelop_compressed(monkeypatch):
+    import base64, gzip
+
+    monkeypatch.setattr(util, "brotli", None)
+    page = {"articles": [{"body": "It takes a Jacobian. " * 100}]}
+    headers = {"Accept": "application/json", "Accept-Encoding": "gzip, deflate, br"}
+    ret = util.envelop(page, event={"headers": headers})
+    assert ret["isBase64Encoded"]
+    assert ret["headers"]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(base64.b64decode(ret["body"]))) == page
+
+    # Small bodies, clients that refuse gzip and clients whose first Accept
+    # type API Gateway would not decode get plain JSON
+    for content, accept, encoding in [
+        ({"tags": []}, "application/json", "gzip"),
+        (page, "application/json", "gzip;q=0"),
+        (page, "*/*, application/json", "gzip"),
+        (page, None, "gzip"),
+    ]:
+        headers = {"Accept": accept, "Accept-Encoding": encoding}
+        ret = util.envelop(content, event={"headers": headers})
+        assert "Content-Encoding" not in ret["headers"]
+        assert not ret.get("isBase64Encoded")
+
+
+def test_envelop_not_modified():
+    content = {"tags": ["dragons", "training"]}
+    etag = util.envelop(content, event={"headers": {}})["headers"]["ETag"]
+
+    ret = util.envelop(content, event={"headers": {"If-None-Match": etag}})
+    assert ret["statusCode"] == 304
+    assert ret["body"] == ""
+    assert ret["headers"]["ETag"] == etag
+
+    ret = util.envelop({"tags": []}, event={"headers": {"if-none-match": etag}})
+    assert ret["statusCode"] == 200
+
+
+def test_parse_body():
+    import base64
+
+    body = json.dumps({"user": {"email": "johndoe@gmail.com"}})
+    encoded = {
+        "body": base64.b64encode(body.encode()).decode(),
+        "isBase64Encoded": True,
+    }
+    assert util.parse_body(encoded) == util.parse_body({"body": body})
+
+
+def test_page_params():
+    assert util.page_params({}) == (20, 0)
+    assert util.page_params({"limit": "5", "offset": "3"}) == (5, 3)
+    assert util.page_params({"limit": "0", "offset": "-1"}) == (1, 0)
+    assert util.page_params({"limit": "100000"}) == (util.PAGE_MAX_LIMIT, 0)
+    assert util.page_params({"limit": "many", "offset": None}) == (20, 0)